@@ -4,6 +4,7 @@ from keras_yolov2.preprocessing import BatchGenerator
 from keras_yolov2.utils import get_session
 from keras_yolov2.frontend import YOLO
 from keras_yolov2.map_evaluation import MapEvaluation
+import numpy as np
 import argparse
 import keras
 import json
@@ -52,13 +53,17 @@ def _main_(args):
         # parse annotations of the training set
         train_imgs, train_labels = parse_annotation_xml(config['train']['train_annot_folder'], 
                                                         config['train']['train_image_folder'],
-                                                        config['model']['labels'])
+                                                        config['model']['labels'],
+                                                        cache_dir=config.get('annotation_cache_dir', ''),
+                                                        as_table=True)
 
         # parse annotations of the validation set, if any.
         if os.path.exists(config['valid']['valid_annot_folder']):
             valid_imgs, valid_labels = parse_annotation_xml(config['valid']['valid_annot_folder'], 
                                                             config['valid']['valid_image_folder'],
-                                                            config['model']['labels'])
+                                                            config['model']['labels'],
+                                                            cache_dir=config.get('annotation_cache_dir', ''),
+                                                            as_table=True)
         else:
             without_valid_imgs = True
 
@@ -66,22 +71,24 @@ def _main_(args):
         # parse annotations of the training set
         train_imgs, train_labels = parse_annotation_csv(config['train']['train_csv_file'],
                                                         config['model']['labels'],
-                                                        config['train']['train_csv_base_path'])
+                                                        config['train']['train_csv_base_path'],
+                                                        cache_dir=config.get('annotation_cache_dir', ''),
+                                                        as_table=True)
 
         # parse annotations of the validation set, if any.
         if os.path.exists(config['valid']['valid_csv_file']):
             valid_imgs, valid_labels = parse_annotation_csv(config['valid']['valid_csv_file'],
                                                             config['model']['labels'],
-                                                            config['valid']['valid_csv_base_path'])
+                                                            config['valid']['valid_csv_base_path'],
+                                                            cache_dir=config.get('annotation_cache_dir', ''),
+                                                            as_table=True)
         else:
             without_valid_imgs = True
     else:
         raise ValueError("'parser_annotations_type' must be 'xml' or 'csv' not {}.".format(config['parser_annotations_type']))
 
     # remove samples without objects in the image
-    for i in range(len(train_imgs)-1, 0, -1):
-        if len(train_imgs[i]['object']) == 0:
-            del train_imgs[i]
+    train_imgs = train_imgs.subset(np.flatnonzero(np.diff(train_imgs.offsets) > 0))
 
     if len(config['model']['labels']) > 0:
         overlap_labels = set(config['model']['labels']).intersection(set(train_labels.keys()))
@@ -138,7 +145,6 @@ def _main_(args):
                 'CLASS': len(yolo.labels),
                 'ANCHORS': yolo._anchors,
                 'BATCH_SIZE': 4,
-                'TRUE_BOX_BUFFER': yolo._max_box_per_image,
             } 
     if not without_valid_imgs:
         valid_generator = BatchGenerator(valid_imgs, 
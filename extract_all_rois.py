@@ -1,5 +1,6 @@
 
-from preprocessing import parse_annotation_xml, parse_annotation_csv
+from keras_yolov2.preprocessing import parse_annotation_xml, parse_annotation_csv
+from keras_yolov2.annotation_table import AnnotationTable
 from tqdm import tqdm
 import numpy as np
 import json
@@ -31,13 +32,15 @@ def _main_(args):
         # parse annotations of the training set
         train_imgs, train_labels = parse_annotation_xml(config['train']['train_annot_folder'], 
                                                     config['train']['train_image_folder'], 
-                                                    config['model']['labels'])
+                                                    config['model']['labels'],
+                                                    cache_dir=config.get('annotation_cache_dir', ''))
 
         # parse annotations of the validation set, if any, otherwise split the training set
         if os.path.exists(config['valid']['valid_annot_folder']):
             valid_imgs, valid_labels = parse_annotation_xml(config['valid']['valid_annot_folder'], 
                                                         config['valid']['valid_image_folder'], 
-                                                        config['model']['labels'])
+                                                        config['model']['labels'],
+                                                        cache_dir=config.get('annotation_cache_dir', ''))
             split = False
         else:
             split = True
@@ -45,13 +48,15 @@ def _main_(args):
         # parse annotations of the training set
         train_imgs, train_labels = parse_annotation_csv(config['train']['train_csv_file'],
                                                         config['model']['labels'],
-                                                        config['train']['train_csv_base_path'])
+                                                        config['train']['train_csv_base_path'],
+                                                        cache_dir=config.get('annotation_cache_dir', ''))
 
         # parse annotations of the validation set, if any, otherwise split the training set
         if os.path.exists(config['valid']['valid_csv_file']):
             valid_imgs, valid_labels = parse_annotation_csv(config['valid']['valid_csv_file'],
                                                         config['model']['labels'],
-                                                        config['valid']['valid_csv_base_path'])
+                                                        config['valid']['valid_csv_base_path'],
+                                                        cache_dir=config.get('annotation_cache_dir', ''))
             split = False
         else:
             split = True
@@ -92,18 +97,16 @@ def _main_(args):
         all_imgs = [train_imgs, valid_imgs]
         for j,folder_name in enumerate(["train", "val"]):
             print("generating", folder_name)
-            for img in tqdm(all_imgs[j]):
-                image = cv2.imread(img['filename'])
-                for i,obj in enumerate(img['object']):
-                    xmin = obj['xmin']
-                    ymin = obj['ymin']
-                    xmax = obj['xmax']
-                    ymax = obj['ymax']
-                    name = obj['name']
+            annotations = AnnotationTable.from_images(all_imgs[j], config['model']['labels'])
+            for k in tqdm(range(len(annotations))):
+                image = cv2.imread(annotations.filenames[k])
+                boxes, class_ids = annotations.image_boxes(k)
+                for i,((xmin, ymin, xmax, ymax), class_id) in enumerate(zip(boxes, class_ids)):
+                    name = annotations.labels[class_id]
                     if not os.path.isdir("roi_dataset/{}/{}".format(folder_name, name)): 
                         os.mkdir("roi_dataset/{}/{}".format(folder_name, name))
                     roi = image[ymin:ymax, xmin:xmax]
-                    base_name = os.path.basename(img['filename'])
+                    base_name = os.path.basename(annotations.filenames[k])
                     base_name, ext = os.path.splitext(base_name)
                     cv2.imwrite("roi_dataset/{}/{}/{}_{}_{}.jpg".format(folder_name,name,name, base_name, i), roi)
 
@@ -2,6 +2,7 @@
 
 from keras_yolov2.utils import get_session
 from keras_yolov2.frontend import YOLO
+from keras_yolov2.frozen import export_frozen_graph
 import argparse
 import keras
 import json
@@ -27,12 +28,40 @@ argparser.add_argument(
     '--input',
     help='path to an image or an video (mp4 format)')
 
+argparser.add_argument(
+    '-d',
+    '--decode',
+    action='store_true',
+    help='add the box decoding and the non max suppression to the exported model')
+
+argparser.add_argument(
+    '-m',
+    '--max_boxes',
+    default=100,
+    type=int,
+    help='maximum number of detections per image of the decoded model')
+
+argparser.add_argument(
+    '-f',
+    '--fold_bn',
+    action='store_true',
+    help='merge the batch normalizations into the convolutions before exporting the model')
+
+argparser.add_argument(
+    '-z',
+    '--freeze',
+    action='store_true',
+    help='also export a frozen graph with a manifest, to be loaded quickly with keras_yolov2.frozen.FrozenYOLO')
+
 
 def _main_(args):
     config_path = args.conf
     weights_path = args.weights
 
     keras.backend.tensorflow_backend.set_session(get_session())
+    if args.freeze:
+        # build the graph without the training branches
+        keras.backend.set_learning_phase(0)
 
     with open(config_path) as config_buffer:    
         config = json.load(config_buffer)
@@ -48,9 +77,25 @@ def _main_(args):
 
     yolo.load_weights(weights_path)
 
-    inference_model = yolo.get_inference_model()
+    if args.fold_bn:
+        difference = yolo.fold_batch_normalization()
+        print("Batch normalizations folded, maximum output difference: {:.2e}".format(difference))
+
+    inference_model = yolo.get_inference_model(decode=args.decode,
+                                               max_boxes=args.max_boxes,
+                                               iou_threshold=config['valid']['iou_threshold'],
+                                               score_threshold=config['valid']['score_threshold'])
     inference_model.save("{}_inference.h5".format(os.path.splitext(weights_path)[0]))
 
+    if args.freeze:
+        frozen_path = "{}_frozen.pb".format(os.path.splitext(weights_path)[0])
+        export_frozen_graph(yolo, frozen_path)
+        print("Frozen graph saved in", frozen_path)
+
+    if args.decode:
+        print("The model outputs [boxes, scores, classes, valid_detections], load it with "
+              "custom_objects={'tf': tf, 'K': keras.backend}.")
+
 
 if __name__ == '__main__':
     _args = argparser.parse_args()
@@ -0,0 +1,49 @@
+import hashlib
+import pickle
+import json
+import os
+
+# change it when the format of the parsed annotations changes, so the old caches are ignored
+CACHE_VERSION = 1
+
+
+def cache_path(cache_dir, kind, sources, labels):
+    """
+    :param cache_dir: folder of the cache files
+    :param kind: 'xml' or 'csv'
+    :param sources: paths the annotations are read from, e.g. the annotation and image folders
+    :param labels: label filter of the parser, the cache of a different filter is a different file
+    :return: path of the cache file of these annotations
+    """
+    key = json.dumps([CACHE_VERSION, kind, [os.path.abspath(source) for source in sources], sorted(labels)])
+    return os.path.join(cache_dir, '{}_{}.pkl'.format(kind, hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
+
+def file_signature(path):
+    """
+    :return: size and modification time of a file, the cached data of a file is used only while they do not change
+    """
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_cache(path):
+    """
+    :return: the cached data, or None if there is no cache or it can't be read
+    """
+    try:
+        with open(path, 'rb') as cache_file:
+            return pickle.load(cache_file)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        return None
+
+
+def save_cache(path, data):
+    """
+    Write the cache into a temporary file first, so an interrupted run never leaves a truncated cache.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary_path, 'wb') as cache_file:
+        pickle.dump(data, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, path)
@@ -0,0 +1,143 @@
+from array import array
+import numpy as np
+
+
+class AnnotationTable(object):
+    """
+    The annotations of a dataset in flat numpy arrays, instead of a dict per image and per object.
+    The boxes of the image i are boxes[offsets[i]:offsets[i + 1]], in the order of the annotation file.
+
+        # Attributes
+            filenames : object array of the image paths
+            widths    : int32 array of the image widths
+            heights   : int32 array of the image heights
+            offsets   : int64 array of the index of the first box of each image, followed by the number of boxes
+            boxes     : int32 array of shape (nb_boxes, 4) with the xmin, ymin, xmax, ymax of each box
+            class_ids : int32 array of the index in labels of the class of each box
+            labels    : list of the class names
+    """
+
+    def __init__(self, filenames, widths, heights, offsets, boxes, class_ids, labels):
+        self.filenames = filenames
+        self.widths = widths
+        self.heights = heights
+        self.offsets = offsets
+        self.boxes = boxes
+        self.class_ids = class_ids
+        self.labels = list(labels)
+        self.label_map = {label: i for i, label in enumerate(self.labels)}
+
+    @classmethod
+    def from_images(cls, images, labels=None):
+        """
+        :param images: iterable of images in the format returned by the annotation parsers, it can be a generator like
+                       iter_annotation_csv, only the arrays are kept
+        :param labels: optional list of the class names, giving the class ids, the other names found in the images get
+                       the next ids
+        :return: AnnotationTable
+        """
+        labels = list(labels) if labels is not None else []
+        label_map = {label: i for i, label in enumerate(labels)}
+
+        filenames = []
+        widths = array('i')
+        heights = array('i')
+        offsets = array('q', [0])
+        boxes = array('i')
+        class_ids = array('i')
+
+        for img in images:
+            filenames.append(img['filename'])
+            widths.append(img.get('width', 0))
+            heights.append(img.get('height', 0))
+
+            for obj in img['object']:
+                if obj['name'] not in label_map:
+                    label_map[obj['name']] = len(labels)
+                    labels.append(obj['name'])
+                boxes.extend((obj['xmin'], obj['ymin'], obj['xmax'], obj['ymax']))
+                class_ids.append(label_map[obj['name']])
+            offsets.append(len(class_ids))
+
+        object_filenames = np.empty(len(filenames), dtype=object)
+        object_filenames[:] = filenames
+
+        return cls(object_filenames,
+                   np.frombuffer(widths, dtype=np.int32),
+                   np.frombuffer(heights, dtype=np.int32),
+                   np.frombuffer(offsets, dtype=np.int64),
+                   np.frombuffer(boxes, dtype=np.int32).reshape(-1, 4),
+                   np.frombuffer(class_ids, dtype=np.int32),
+                   labels)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def subset(self, indices):
+        """
+        :param indices: indices of the images to keep, in the order of the new table
+        :return: AnnotationTable with these images and the same labels
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        counts = np.diff(self.offsets)[indices]
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        # the boxes of each kept image are moved from its old offset to its new one
+        box_indices = np.repeat(self.offsets[indices] - offsets[:-1], counts) + np.arange(offsets[-1])
+
+        return AnnotationTable(self.filenames[indices], self.widths[indices], self.heights[indices], offsets,
+                               self.boxes[box_indices], self.class_ids[box_indices], self.labels)
+
+    def merge_duplicates(self):
+        """
+        :return: AnnotationTable where the images with the same filename are merged into the first one, their boxes
+                 keep the order of the table, like parse_annotation_csv does with the rows of an image which are not
+                 consecutive
+        """
+        _, first, inverse = np.unique(self.filenames, return_index=True, return_inverse=True)
+        if len(first) == len(self):
+            return self
+
+        # the merged images follow the order of their first occurrence
+        rank = np.empty(len(first), dtype=np.int64)
+        rank[np.argsort(first, kind='stable')] = np.arange(len(first))
+        box_image_ids = rank[inverse.reshape(-1)][self.box_image_indices()]
+        box_order = np.argsort(box_image_ids, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(box_image_ids, minlength=len(first)))]).astype(np.int64)
+
+        kept = np.sort(first)
+        return AnnotationTable(self.filenames[kept], self.widths[kept], self.heights[kept], offsets,
+                               self.boxes[box_order], self.class_ids[box_order], self.labels)
+
+    def image_boxes(self, i):
+        """
+        :return: views on the boxes and the class ids of the image i
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.boxes[start:end], self.class_ids[start:end]
+
+    def box_image_indices(self):
+        """
+        :return: array with the index of the image of each box
+        """
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    def class_ids_for(self, labels):
+        """
+        :param labels: list of class names, like the labels of a model
+        :return: array mapping each class id of the table to the index of its name in labels, -1 if it is not in them
+        """
+        return np.array([labels.index(label) if label in labels else -1 for label in self.labels], dtype=np.int32)
+
+    def image(self, i):
+        """
+        :return: the image i as a new dict, in the format returned by the annotation parsers
+        """
+        boxes, class_ids = self.image_boxes(i)
+        objects = [{'xmin': int(xmin), 'ymin': int(ymin), 'xmax': int(xmax), 'ymax': int(ymax),
+                    'name': self.labels[class_id]}
+                   for (xmin, ymin, xmax, ymax), class_id in zip(boxes, class_ids)]
+
+        return {'object': objects,
+                'filename': self.filenames[i],
+                'width': int(self.widths[i]),
+                'height': int(self.heights[i])}
@@ -3,10 +3,9 @@ import tensorflow as tf
 from keras.layers import Reshape, Activation, Conv2D, Input, MaxPooling2D, BatchNormalization, Flatten, Dense, Lambda
 from keras.layers.advanced_activations import LeakyReLU
 from keras.layers.merge import concatenate
-from keras.applications.mobilenet import MobileNet
-from keras.applications import InceptionV3
-from keras.applications.vgg16 import VGG16
-from keras.applications.resnet50 import ResNet50
+
+# the keras.applications models are imported inside the feature extractors using them, since importing them all is
+# slow and most configurations use only one backend
 
 base_path = './backend_weights/'  # FIXME :: use environment variables
 
@@ -18,10 +17,16 @@ INCEPTION3_BACKEND_PATH = base_path + "inception_backend.h5"  # should be hosted
 VGG16_BACKEND_PATH = base_path + "vgg16_backend.h5"  # should be hosted on a server
 RESNET50_BACKEND_PATH = base_path + "resnet50_backend.h5"  # should be hosted on a server
 
+# weights of the keras.applications backends, None builds them with random weights and without downloading anything
+APPLICATIONS_WEIGHTS = 'imagenet'
+
 
 class BaseFeatureExtractor(object):
     """docstring for ClassName"""
 
+    # name of the normalization, to normalize the images without the feature extractor, see utils.normalize_image
+    normalize_mode = None
+
     # to be defined in each subclass
     def __init__(self, input_size):
         raise NotImplementedError("error message")
@@ -30,8 +35,14 @@ class BaseFeatureExtractor(object):
     def normalize(self, image):
         raise NotImplementedError("error message")
 
-    def get_output_shape(self):
-        return self.feature_extractor.get_output_shape_at(-1)[1:3]
+    def get_output_shape(self, input_size=None):
+        """
+        :param input_size: (height, width, channels) of the input, needed for extractors built with a flexible input
+        :return: (grid_h, grid_w)
+        """
+        if input_size is None:
+            return self.feature_extractor.get_output_shape_at(-1)[1:3]
+        return self.feature_extractor.compute_output_shape((None,) + tuple(input_size))[1:3]
 
     def extract(self, input_image):
         return self.feature_extractor(input_image)
@@ -40,6 +51,8 @@ class BaseFeatureExtractor(object):
 class FullYoloFeature(BaseFeatureExtractor):
     """docstring for ClassName"""
 
+    normalize_mode = 'scale'
+
     def __init__(self, input_size):
         input_image = Input(shape=input_size)
 
@@ -186,6 +199,8 @@ class FullYoloFeature(BaseFeatureExtractor):
 class TinyYoloFeature(BaseFeatureExtractor):
     """docstring for ClassName"""
 
+    normalize_mode = 'scale'
+
     def __init__(self, input_size):
         input_image = Input(shape=input_size)
 
@@ -232,10 +247,14 @@ class TinyYoloFeature(BaseFeatureExtractor):
 class MobileNetFeature(BaseFeatureExtractor):
     """docstring for ClassName"""
 
+    normalize_mode = 'symmetric'
+
     def __init__(self, input_size):
+        from keras.applications.mobilenet import MobileNet
+
         input_image = Input(shape=input_size)
 
-        mobilenet = MobileNet(input_shape=input_size, include_top=False)
+        mobilenet = MobileNet(input_shape=input_size, include_top=False, weights=APPLICATIONS_WEIGHTS)
         if input_size[2] == 3:
             try:
                 print("Loading pretrained weights: " + MOBILENET_BACKEND_PATH)
@@ -260,6 +279,8 @@ class MobileNetFeature(BaseFeatureExtractor):
 class SqueezeNetFeature(BaseFeatureExtractor):
     """docstring for ClassName"""
 
+    normalize_mode = 'caffe'
+
     def __init__(self, input_size):
 
         # define some auxiliary variables and the fire module
@@ -327,10 +348,14 @@ class SqueezeNetFeature(BaseFeatureExtractor):
 class Inception3Feature(BaseFeatureExtractor):
     """docstring for ClassName"""
 
+    normalize_mode = 'symmetric'
+
     def __init__(self, input_size):
+        from keras.applications import InceptionV3
+
         input_image = Input(shape=input_size)
 
-        inception = InceptionV3(input_shape=input_size, include_top=False)
+        inception = InceptionV3(input_shape=input_size, include_top=False, weights=APPLICATIONS_WEIGHTS)
         if input_size[2] == 3:
             try:
                 inception.load_weights(INCEPTION3_BACKEND_PATH)
@@ -354,8 +379,12 @@ class Inception3Feature(BaseFeatureExtractor):
 class VGG16Feature(BaseFeatureExtractor):
     """docstring for ClassName"""
 
+    normalize_mode = 'caffe'
+
     def __init__(self, input_size):
-        vgg16 = VGG16(input_shape=input_size, include_top=False)
+        from keras.applications.vgg16 import VGG16
+
+        vgg16 = VGG16(input_shape=input_size, include_top=False, weights=APPLICATIONS_WEIGHTS)
         # vgg16.load_weights(VGG16_BACKEND_PATH)
 
         self.feature_extractor = vgg16
@@ -374,8 +403,12 @@ class VGG16Feature(BaseFeatureExtractor):
 class ResNet50Feature(BaseFeatureExtractor):
     """docstring for ClassName"""
 
+    normalize_mode = 'caffe'
+
     def __init__(self, input_size):
-        resnet50 = ResNet50(input_shape=input_size, include_top=False)
+        from keras.applications.resnet50 import ResNet50
+
+        resnet50 = ResNet50(input_shape=input_size, include_top=False, weights=APPLICATIONS_WEIGHTS)
         resnet50.layers.pop()  # remove the average pooling layer
         # resnet50.load_weights(RESNET50_BACKEND_PATH)
 
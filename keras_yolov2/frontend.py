@@ -1,22 +1,32 @@
 from .yolo_loss import YoloLoss
 from .map_evaluation import MapEvaluation
-from .utils import decode_netout, import_feature_extractor, import_dynamically
+from .utils import (decode_netout, import_feature_extractor, import_dynamically, preprocess_image, Detections,
+                    non_max_suppression)
 from .preprocessing import BatchGenerator
+from .optimize import fold_batch_normalization
+from .pruning import select_channels, prune_model
 from keras.models import Model
-from keras.layers import Reshape, Conv2D, Input
+from keras import backend as K
+from keras.layers import Reshape, Conv2D, Input, Lambda
 from keras.optimizers import Adam
 from keras.callbacks import EarlyStopping, ModelCheckpoint, TensorBoard
+import tensorflow as tf
 import numpy as np
 import sys
-import cv2
 import os
 
 
 class YOLO(object):
-    def __init__(self, backend, input_size, labels, anchors, gray_mode=False):
+    def __init__(self, backend, input_size, labels, anchors, gray_mode=False, flexible_input=False, verbose=True):
+        """
+        :param flexible_input: if True the model accepts any input size, input_size is then only the default size used
+                               for training and prediction, and predict can take a different input_size per call
+        :param verbose: if False the grid size and the model summary are not printed
+        """
 
         self._input_size = input_size
         self._gray_mode = gray_mode
+        self._flexible_input = flexible_input
         self.labels = list(labels)
         self._nb_class = len(self.labels)
         self._nb_box = len(anchors) // 2
@@ -30,15 +40,20 @@ class YOLO(object):
         # make the feature extractor layers
         if self._gray_mode:
             self._input_size = (self._input_size[0], self._input_size[1], 1)
-            input_image = Input(shape=self._input_size)
         else:
             self._input_size = (self._input_size[0], self._input_size[1], 3)
-            input_image = Input(shape=self._input_size)
 
-        self._feature_extractor = import_feature_extractor(backend, self._input_size)
+        if self._flexible_input:
+            model_input_size = (None, None, self._input_size[2])
+        else:
+            model_input_size = self._input_size
+        input_image = Input(shape=model_input_size)
+
+        self._feature_extractor = import_feature_extractor(backend, model_input_size)
 
-        print(self._feature_extractor.get_output_shape())
-        self._grid_h, self._grid_w = self._feature_extractor.get_output_shape()
+        self._grid_h, self._grid_w = self._feature_extractor.get_output_shape(self._input_size)
+        if verbose:
+            print((self._grid_h, self._grid_w))
         features = self._feature_extractor.extract(input_image)
 
         # make the object detection layer
@@ -47,7 +62,14 @@ class YOLO(object):
                         padding='same',
                         name='Detection_layer',
                         kernel_initializer='lecun_normal')(features)
-        output = Reshape((self._grid_h, self._grid_w, self._nb_box, 4 + 1 + self._nb_class), name="YOLO_output")(output)
+        if self._flexible_input:
+            output = Lambda(_reshape_output,
+                            output_shape=(None, None, self._nb_box, 4 + 1 + self._nb_class),
+                            arguments={'nb_box': self._nb_box, 'nb_values': 4 + 1 + self._nb_class},
+                            name="YOLO_output")(output)
+        else:
+            output = Reshape((self._grid_h, self._grid_w, self._nb_box, 4 + 1 + self._nb_class),
+                             name="YOLO_output")(output)
 
         self._model = Model(input_image, output)
 
@@ -61,7 +83,8 @@ class YOLO(object):
         layer.set_weights([new_kernel, new_bias])
 
         # print a summary of the whole model
-        self._model.summary()
+        if verbose:
+            self._model.summary()
 
         # declare class variables
         self._batch_size = None
@@ -75,8 +98,8 @@ class YOLO(object):
     def load_weights(self, weight_path):
         self._model.load_weights(weight_path)
 
-    def train(self, train_imgs,  # the list of images to train the model
-              valid_imgs,  # the list of images used to validate the model
+    def train(self, train_imgs,  # the AnnotationTable, or list of images, to train the model
+              valid_imgs,  # the AnnotationTable, or list of images, used to validate the model
               train_times,  # the number of time to repeat the training set, often used for small datasets
               valid_times,  # the number of times to repeat the validation set, often used for small datasets
               nb_epochs,  # number of epoches
@@ -207,31 +230,290 @@ class YOLO(object):
                                   workers=workers,
                                   max_queue_size=max_queue_size)
 
-    def get_inference_model(self):
-        return self._model
+    def fold_batch_normalization(self, tolerance=1e-3):
+        """
+        Merge the batch normalizations into the preceding convolutions, to predict faster with a smaller model. The
+        folded model can't be trained or load the weights of the original model anymore.
+        :param tolerance: maximum absolute difference allowed between the outputs of both models on a random image
+        :return: maximum absolute difference between the outputs of both models
+        """
+        folded_model = fold_batch_normalization(self._model)
+
+        image = np.random.randint(0, 256, size=(self._input_size[0], self._input_size[1], 3), dtype=np.uint8)
+        input_image = preprocess_image(image, self._input_size, self._feature_extractor.normalize, self._gray_mode)
+        input_image = input_image[np.newaxis]
+
+        difference = float(np.max(np.abs(self._model.predict(input_image) - folded_model.predict(input_image))))
+        if difference > tolerance:
+            raise RuntimeError("The folded model outputs differ by {}, more than the tolerance {}.".format(
+                difference, tolerance))
+
+        self._model = folded_model
+        return difference
+
+    def prune_channels(self, ratio):
+        """
+        Remove the filters with the smallest batch normalization gamma from the conv_i layers, the model becomes
+        slimmer and should be fine-tuned with train afterwards. The pruned model can't load the weights of the
+        original one anymore, save it as a whole model instead.
+        :param ratio: fraction of the filters to remove from each prunable convolution
+        :return: dict mapping the name of each pruned convolution to the indices of the kept filters
+        """
+        keep = select_channels(self._model, ratio)
+        self._model = prune_model(self._model, keep)
+
+        return keep
+
+    def get_inference_model(self, decode=False, max_boxes=100, iou_threshold=0.5, score_threshold=0.5):
+        """
+        :param decode: if True, the anchor decoding, the score threshold and the non max suppression are added to the
+                       graph, and the model outputs [boxes, scores, classes, valid_detections] padded to max_boxes,
+                       the detections of decode_netout sorted by score
+        :param max_boxes: maximum number of detections per image, used only with decode
+        :param iou_threshold: IoU threshold of the non max suppression, used only with decode
+        :param score_threshold: minimum score to keep a box, used only with decode
+        :return: keras model
+        """
+        if not decode:
+            return self._model
+
+        detections = Lambda(_decode_graph,
+                            arguments={'anchors': self._anchors},
+                            name='YOLO_decoded')(self._model.output)
+        detections = Lambda(_nms_graph,
+                            arguments={'max_boxes': max_boxes,
+                                       'iou_threshold': iou_threshold,
+                                       'score_threshold': score_threshold},
+                            name='YOLO_nms')(detections)
+
+        boxes = Lambda(lambda x: x[..., :4], name='boxes')(detections)
+        scores = Lambda(lambda x: x[..., 4], name='scores')(detections)
+        classes = Lambda(lambda x: x[..., 5], name='classes')(detections)
+        valid_detections = Lambda(lambda x: K.sum(K.cast(x[..., 5] >= 0, 'int32'), axis=-1),
+                                  name='valid_detections')(detections)
+
+        return Model(self._model.input, [boxes, scores, classes, valid_detections])
+
+    def predict(self, image, iou_threshold=0.5, score_threshold=0.5, as_detections=False, input_size=None):
+        """
+        :param input_size: (height, width) used for this prediction, only for models built with flexible_input, it
+                           should be a multiple of the feature extractor stride
+        """
+        input_size = self._get_input_size(input_size)
+        input_image = preprocess_image(image, input_size, self._feature_extractor.normalize, self._gray_mode)
+        input_image = input_image[np.newaxis]
 
-    def predict(self, image, iou_threshold=0.5, score_threshold=0.5):
+        netout = self._model.predict(input_image)[0]
 
-        if len(image.shape) == 3 and self._gray_mode:
-            if image.shape[2] == 3:
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-                image = image[..., np.newaxis]
-        elif len(image.shape) == 2 and not self._gray_mode:
-            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
-        elif len(image.shape) == 2:
-            image = image[..., np.newaxis]
+        boxes = decode_netout(netout, self._anchors, self._nb_class, score_threshold, iou_threshold, as_detections)
 
-        image = cv2.resize(image, (self._input_size[1], self._input_size[0]))
-        image = image[..., ::-1]  # make it RGB (it is important for normalization of some backends)
+        return boxes
 
-        image = self._feature_extractor.normalize(image)
-        if len(image.shape) == 3:
-            input_image = image[np.newaxis, :]
-        else:
-            input_image = image[np.newaxis, ..., np.newaxis]
+    def predict_batch(self, images, batch_size=8, iou_threshold=0.5, score_threshold=0.5, as_detections=False,
+                      input_size=None):
+        """
+        Same as predict, but running the model once for each chunk of batch_size images.
+        :param images: list of images, they can have different sizes
+        :return: list with the boxes of each image, in the same order of images
+        """
+        input_size = self._get_input_size(input_size)
+        all_boxes = []
+
+        for l_bound in range(0, len(images), batch_size):
+            chunk = images[l_bound:l_bound + batch_size]
+
+            input_images = np.empty((len(chunk),) + input_size, dtype=np.float32)
+            for i, image in enumerate(chunk):
+                input_images[i] = preprocess_image(image, input_size, self._feature_extractor.normalize,
+                                                   self._gray_mode)
+
+            netouts = self._model.predict_on_batch(input_images)
+
+            for netout in netouts:
+                all_boxes.append(decode_netout(netout, self._anchors, self._nb_class, score_threshold, iou_threshold,
+                                               as_detections))
+
+        return all_boxes
+
+    def _get_input_size(self, input_size):
+        if input_size is None:
+            return tuple(self._input_size)
+        if not self._flexible_input:
+            raise ValueError("The input size can only be changed on models built with flexible_input=True.")
+
+        return int(input_size[0]), int(input_size[1]), self._input_size[2]
+
+    def predict_tiled(self, image, tile_size=None, overlap=0.2, batch_size=8, iou_threshold=0.5, score_threshold=0.5,
+                      include_full_image=False, input_size=None):
+        """
+        Predict a large image by splitting it into overlapping tiles which are predicted as batches, so small objects
+        are not lost when the image is resized to the network input.
+        :param tile_size: (height, width) of the tiles in pixels, by default the network input size
+        :param overlap: fraction of each tile shared with its neighbours
+        :param include_full_image: also predict the whole resized image, useful for objects bigger than a tile
+        :param input_size: (height, width) the tiles are resized to, only for models built with flexible_input, it is
+                           also the default tile size
+        :return: Detections relative to the whole image, duplicates across tiles are merged with non max suppression
+        """
+        image_h, image_w = image.shape[:2]
+        if tile_size is None:
+            tile_size = self._get_input_size(input_size)[:2]
+        tile_h, tile_w = min(tile_size[0], image_h), min(tile_size[1], image_w)
+
+        offsets = [(y, x)
+                   for y in _tile_offsets(image_h, tile_h, overlap)
+                   for x in _tile_offsets(image_w, tile_w, overlap)]
+        tiles = [image[y:y + tile_h, x:x + tile_w] for y, x in offsets]
+
+        all_boxes = self.predict_batch(tiles,
+                                       batch_size=batch_size,
+                                       iou_threshold=iou_threshold,
+                                       score_threshold=score_threshold,
+                                       as_detections=True,
+                                       input_size=input_size)
+
+        # from tile relative coordinates to whole image relative coordinates
+        tile_scale = np.array([tile_w, tile_h, tile_w, tile_h], dtype=np.float32)
+        image_scale = np.array([image_w, image_h, image_w, image_h], dtype=np.float32)
+        boxes = [(tile_boxes.boxes * tile_scale + [x, y, x, y]) / image_scale
+                 for (y, x), tile_boxes in zip(offsets, all_boxes)]
+        scores = [tile_boxes.scores for tile_boxes in all_boxes]
+        labels = [tile_boxes.labels for tile_boxes in all_boxes]
+
+        if include_full_image:
+            full_boxes = self.predict(image, iou_threshold, score_threshold, as_detections=True,
+                                      input_size=input_size)
+            boxes.append(full_boxes.boxes)
+            scores.append(full_boxes.scores)
+            labels.append(full_boxes.labels)
+
+        detections = Detections(np.concatenate(boxes), np.concatenate(scores), np.concatenate(labels))
+        keep = non_max_suppression(detections.boxes, detections.scores, iou_threshold, detections.labels)
+
+        return detections[keep]
+
+
+def _reshape_output(x, nb_box, nb_values):
+    shape = tf.shape(x)
+    return tf.reshape(x, (shape[0], shape[1], shape[2], nb_box, nb_values))
+
+
+def _tile_offsets(length, tile, overlap):
+    stride = max(int(tile * (1 - overlap)), 1)
+    offsets = list(range(0, length - tile + 1, stride))
+    if offsets[-1] + tile < length:
+        offsets.append(length - tile)
+    return offsets
+
+
+def _decode_graph(netout, anchors):
+    """
+    Graph version of the decoding of decode_netout, before the score threshold.
+    :return: (batch, grid_h * grid_w * nb_box, 4 + nb_class) tensor with [xmin, ymin, xmax, ymax] and the score of each
+             class
+    """
+    grid_h = tf.shape(netout)[1]
+    grid_w = tf.shape(netout)[2]
+    nb_box = len(anchors) // 2
+
+    cell_x = tf.reshape(tf.cast(tf.range(grid_w), tf.float32), (1, 1, -1, 1))
+    cell_y = tf.reshape(tf.cast(tf.range(grid_h), tf.float32), (1, -1, 1, 1))
+    anchors = tf.reshape(tf.constant(anchors, dtype=tf.float32), (1, 1, 1, nb_box, 2))
+
+    x = (cell_x + tf.sigmoid(netout[..., 0])) / tf.cast(grid_w, tf.float32)
+    y = (cell_y + tf.sigmoid(netout[..., 1])) / tf.cast(grid_h, tf.float32)
+    w = anchors[..., 0] * tf.exp(netout[..., 2]) / tf.cast(grid_w, tf.float32)
+    h = anchors[..., 1] * tf.exp(netout[..., 3]) / tf.cast(grid_h, tf.float32)
+
+    confidence = tf.sigmoid(netout[..., 4])
+    classes = confidence[..., tf.newaxis] * _softmax_graph(netout[..., 5:])
+
+    detections = tf.concat([tf.stack([x - w / 2, y - h / 2, x + w / 2, y + h / 2], axis=-1), classes], axis=-1)
+
+    return tf.reshape(detections, (tf.shape(netout)[0], -1, tf.shape(netout)[4] - 1))
+
+
+def _softmax_graph(x, t=-100.):
+    # same as utils._softmax, the maximum and the minimum are taken over the whole grid of each image
+    x = x - tf.reduce_max(x, axis=[1, 2, 3, 4], keepdims=True)
+    x_min = tf.reduce_min(x, axis=[1, 2, 3, 4], keepdims=True)
+    x = x * (t / tf.minimum(x_min, t))
+
+    # the maximum of each cell does not change the result, but keeps exp from underflowing to zero for all its classes
+    e_x = tf.exp(x - tf.reduce_max(x, axis=-1, keepdims=True))
+
+    return e_x / tf.reduce_sum(e_x, axis=-1, keepdims=True)
+
+
+def _nms_graph(detections, max_boxes, iou_threshold, score_threshold):
+    """
+    Graph version of the suppression of decode_netout, a greedy non max suppression per image and per class, a box is
+    suppressed from a class when its IoU with a better box of this class is >= iou_threshold, and kept while it has a
+    class left.
+    :return: (batch, max_boxes, 6) tensor with [xmin, ymin, xmax, ymax, score, class] sorted by score, padded with zero
+             boxes and class -1
+    """
+    def image_nms(image_detections):
+        classes = image_detections[:, 4:]
+        classes = classes * tf.cast(classes > score_threshold, tf.float32)
+
+        # only the boxes with a class above the threshold take part in the suppression
+        candidates = tf.reduce_any(classes > 0, axis=-1)
+        boxes = tf.boolean_mask(image_detections[:, :4], candidates)
+        classes = tf.boolean_mask(classes, candidates)
+        nb_candidates = tf.shape(boxes)[0]
+
+        overlaps = _overlap_graph(boxes)
+        # the candidates of each class by decreasing score, the ties keep the order of the grid like a stable sort
+        order = tf.transpose(tf.nn.top_k(tf.transpose(classes), k=nb_candidates).indices)
+        class_ids = tf.range(tf.shape(classes)[1])
+        box_ids = tf.range(nb_candidates)
+
+        def suppress(i, alive):
+            best = order[i]
+            best_indices = tf.stack([best, class_ids], axis=1)
+            kept = tf.logical_and(tf.gather_nd(alive, best_indices), tf.gather_nd(classes, best_indices) > 0)
+
+            suppressed = tf.logical_and(tf.transpose(tf.gather(overlaps, best)) >= iou_threshold,
+                                        tf.not_equal(box_ids[:, tf.newaxis], best[tf.newaxis]))
+            suppressed = tf.logical_and(suppressed, kept[tf.newaxis])
+            return i + 1, tf.logical_and(alive, tf.logical_not(suppressed))
 
-        netout = self._model.predict(input_image)[0]
+        _, alive = tf.while_loop(lambda i, alive: i < nb_candidates, suppress,
+                                 [tf.constant(0), tf.ones_like(classes, dtype=tf.bool)])
+        classes = classes * tf.cast(alive, tf.float32)
 
-        boxes = decode_netout(netout, self._anchors, self._nb_class, score_threshold, iou_threshold)
+        # the boxes without class left are removed
+        scores = tf.reduce_max(classes, axis=-1)
+        kept = scores > score_threshold
+        boxes = tf.boolean_mask(boxes, kept)
+        labels = tf.boolean_mask(tf.cast(tf.argmax(classes, axis=-1), tf.float32), kept)
+        scores = tf.boolean_mask(scores, kept)
 
-        return boxes
+        best = tf.nn.top_k(scores, k=tf.minimum(max_boxes, tf.shape(scores)[0]))
+        selected = tf.concat([tf.gather(boxes, best.indices),
+                              best.values[:, tf.newaxis],
+                              tf.gather(labels, best.indices)[:, tf.newaxis]], axis=1)
+
+        padding = tf.tile(tf.constant([[0., 0., 0., 0., 0., -1.]]), [max_boxes - tf.shape(selected)[0], 1])
+        return tf.reshape(tf.concat([selected, padding], axis=0), (max_boxes, 6))
+
+    return tf.map_fn(image_nms, detections)
+
+
+def _overlap_graph(boxes):
+    """
+    Graph version of utils.compute_overlap.
+    :return: (N, N) tensor with the IoU of each pair of boxes
+    """
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+    iw = tf.minimum(boxes[:, tf.newaxis, 2], boxes[tf.newaxis, :, 2]) - \
+        tf.maximum(boxes[:, tf.newaxis, 0], boxes[tf.newaxis, :, 0])
+    ih = tf.minimum(boxes[:, tf.newaxis, 3], boxes[tf.newaxis, :, 3]) - \
+        tf.maximum(boxes[:, tf.newaxis, 1], boxes[tf.newaxis, :, 1])
+    intersection = tf.maximum(iw, 0.) * tf.maximum(ih, 0.)
+
+    union = tf.maximum(area[:, tf.newaxis] + area[tf.newaxis] - intersection, np.finfo(float).eps)
+
+    return intersection / union
@@ -0,0 +1,122 @@
+from .utils import decode_netout, preprocess_image, normalize_image
+from functools import partial
+import tensorflow as tf
+import numpy as np
+import json
+
+MANIFEST_NODE = 'yolo_manifest'
+
+_TRANSFORMS = ['remove_nodes(op=Identity, op=CheckNumerics)',
+               'fold_constants(ignore_errors=true)',
+               'fold_batch_norms',
+               'fold_old_batch_norms',
+               'strip_unused_nodes',
+               'sort_by_execution_order']
+
+
+def export_frozen_graph(yolo, output_path):
+    """
+    Write the model into a single protobuf file: the graph with the weights as constants and the constants folded,
+    plus a manifest with everything needed to predict (labels, anchors, input size and normalization).
+    The learning phase must be set to 0 with keras.backend.set_learning_phase before building the YOLO object, so the
+    graph does not keep the training branches of the batch normalizations and dropouts.
+    :param yolo: YOLO object with the weights already loaded
+    :param output_path: path of the .pb file
+    """
+    from tensorflow.tools.graph_transforms import TransformGraph
+    from keras import backend as K
+
+    normalize_mode = yolo._feature_extractor.normalize_mode
+    if normalize_mode is None:
+        raise ValueError("The feature extractor must define normalize_mode to be exported as a frozen graph.")
+
+    model = yolo.get_inference_model()
+    input_name = model.input.op.name
+    output_name = model.output.op.name
+
+    session = K.get_session()
+    graph_def = tf.graph_util.convert_variables_to_constants(session, session.graph.as_graph_def(), [output_name])
+    graph_def = TransformGraph(graph_def, [input_name], [output_name], _TRANSFORMS)
+
+    manifest = {'labels': yolo.labels,
+                'anchors': yolo._anchors,
+                'input_size': list(yolo._input_size),
+                'gray_mode': yolo._gray_mode,
+                'normalize_mode': normalize_mode,
+                'input_name': input_name,
+                'output_name': output_name}
+
+    manifest_node = graph_def.node.add()
+    manifest_node.name = MANIFEST_NODE
+    manifest_node.op = 'Const'
+    manifest_node.attr['dtype'].type = tf.string.as_datatype_enum
+    manifest_node.attr['value'].tensor.CopyFrom(tf.make_tensor_proto(json.dumps(manifest)))
+
+    with open(output_path, 'wb') as graph_file:
+        graph_file.write(graph_def.SerializeToString())
+
+
+def read_manifest(graph_def):
+    """
+    :param graph_def: GraphDef written by export_frozen_graph
+    :return: dict with the manifest
+    """
+    for node in graph_def.node:
+        if node.name == MANIFEST_NODE:
+            return json.loads(node.attr['value'].tensor.string_val[0].decode('utf-8'))
+    raise ValueError("The graph has no manifest, it was not written by export_frozen_graph.")
+
+
+class FrozenYOLO(object):
+    """
+    Predictor loading a graph written by export_frozen_graph, with the same prediction API as YOLO. The keras model is
+    never built, so it is ready to predict much sooner than a YOLO object.
+
+    # Arguments
+        graph_path     : path of the .pb file.
+        session_config : optional tf.ConfigProto of the session running the graph.
+    """
+
+    def __init__(self, graph_path, session_config=None):
+        graph_def = tf.GraphDef()
+        with open(graph_path, 'rb') as graph_file:
+            graph_def.ParseFromString(graph_file.read())
+
+        manifest = read_manifest(graph_def)
+        self.labels = manifest['labels']
+        self._nb_class = len(self.labels)
+        self._anchors = manifest['anchors']
+        self._input_size = tuple(manifest['input_size'])
+        self._gray_mode = manifest['gray_mode']
+        self._normalize = partial(normalize_image, mode=manifest['normalize_mode'])
+
+        if session_config is None:
+            session_config = tf.ConfigProto()
+            session_config.gpu_options.allow_growth = True
+
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self._session = tf.Session(graph=self._graph, config=session_config)
+        self._input = self._graph.get_tensor_by_name(manifest['input_name'] + ':0')
+        self._output = self._graph.get_tensor_by_name(manifest['output_name'] + ':0')
+
+    def predict(self, image, iou_threshold=0.5, score_threshold=0.5, as_detections=False):
+        return self.predict_batch([image], 1, iou_threshold, score_threshold, as_detections)[0]
+
+    def predict_batch(self, images, batch_size=8, iou_threshold=0.5, score_threshold=0.5, as_detections=False):
+        results = []
+        for l_bound in range(0, len(images), batch_size):
+            batch = images[l_bound:l_bound + batch_size]
+            input_images = np.empty((len(batch),) + self._input_size, dtype=np.float32)
+            for i, image in enumerate(batch):
+                input_images[i] = preprocess_image(image, self._input_size, self._normalize, self._gray_mode)
+
+            netouts = self._session.run(self._output, feed_dict={self._input: input_images})
+            results.extend(decode_netout(netout, self._anchors, self._nb_class, score_threshold, iou_threshold,
+                                         as_detections)
+                           for netout in netouts)
+        return results
+
+    def close(self):
+        self._session.close()
@@ -1,4 +1,4 @@
-from .utils import compute_overlap, compute_ap
+from .utils import compute_overlap, compute_ap, Detections
 import tensorflow as tf
 import numpy as np
 import keras
@@ -80,73 +80,63 @@ class MapEvaluation(keras.callbacks.Callback):
         all_annotations = [[None for _ in range(self._generator.num_classes())]
                            for _ in range(self._generator.size())]
 
-        for i in range(self._generator.size()):
-            raw_image = self._generator.load_image(i)
-            raw_height, raw_width, _ = raw_image.shape
+        batch_size = self._generator.batch_size()
+        for l_bound in range(0, self._generator.size(), batch_size):
+            indices = range(l_bound, min(l_bound + batch_size, self._generator.size()))
+            raw_images = [self._generator.load_image(i) for i in indices]
 
             # make the boxes and the labels
-            pred_boxes = self._yolo.predict(raw_image,
-                                            iou_threshold=self._iou_threshold,
-                                            score_threshold=self._score_threshold)
+            all_pred_boxes = self._yolo.predict_batch(raw_images,
+                                                      batch_size=batch_size,
+                                                      iou_threshold=self._iou_threshold,
+                                                      score_threshold=self._score_threshold,
+                                                      as_detections=True)
 
-            score = np.array([box.score for box in pred_boxes])
-            pred_labels = np.array([box.label for box in pred_boxes])
-
-            if len(pred_boxes) > 0:
-                pred_boxes = np.array([[box.xmin * raw_width, box.ymin * raw_height, box.xmax * raw_width,
-                                        box.ymax * raw_height, box.score] for box in pred_boxes])
-            else:
-                pred_boxes = np.array([[]])
-
-            # sort the boxes and the labels according to scores
-            score_sort = np.argsort(-score)
-            pred_labels = pred_labels[score_sort]
-            pred_boxes = pred_boxes[score_sort]
-
-            # copy detections to all_detections
-            for label in range(self._generator.num_classes()):
-                all_detections[i][label] = pred_boxes[pred_labels == label, :]
-
-            annotations = self._generator.load_annotation(i)
-
-            # copy ground truth to all_annotations
-            for label in range(self._generator.num_classes()):
-                all_annotations[i][label] = annotations[annotations[:, 4] == label, :4].copy()
+            for i, raw_image, pred_boxes in zip(indices, raw_images, all_pred_boxes):
+                self._gather_image(i, raw_image, pred_boxes, all_detections, all_annotations)
 
         # compute mAP by comparing all detections and all annotations
         average_precisions = {}
 
         for label in range(self._generator.num_classes()):
-            false_positives = np.zeros((0,))
-            true_positives = np.zeros((0,))
-            scores = np.zeros((0,))
+            false_positives = []
+            true_positives = []
+            scores = []
             num_annotations = 0.0
 
             for i in range(self._generator.size()):
                 detections = all_detections[i][label]
                 annotations = all_annotations[i][label]
                 num_annotations += annotations.shape[0]
-                detected_annotations = []
 
-                for d in detections:
-                    scores = np.append(scores, d[4])
+                if detections.shape[0] == 0:
+                    continue
+
+                scores.append(detections[:, 4])
+
+                if annotations.shape[0] == 0:
+                    false_positives.append(np.ones(detections.shape[0]))
+                    true_positives.append(np.zeros(detections.shape[0]))
+                    continue
+
+                # detections are sorted by score, so a single overlap matrix is enough to assign them greedily
+                overlaps = compute_overlap(detections, annotations)
+                assigned_annotations = np.argmax(overlaps, axis=1)
+                max_overlaps = overlaps[np.arange(detections.shape[0]), assigned_annotations]
 
-                    if annotations.shape[0] == 0:
-                        false_positives = np.append(false_positives, 1)
-                        true_positives = np.append(true_positives, 0)
-                        continue
+                image_true_positives = np.zeros(detections.shape[0])
+                detected_annotations = set()
+                for d, assigned_annotation in enumerate(assigned_annotations):
+                    if max_overlaps[d] >= self._iou_threshold and assigned_annotation not in detected_annotations:
+                        image_true_positives[d] = 1
+                        detected_annotations.add(assigned_annotation)
 
-                    overlaps = compute_overlap(np.expand_dims(d, axis=0), annotations)
-                    assigned_annotation = np.argmax(overlaps, axis=1)
-                    max_overlap = overlaps[0, assigned_annotation]
+                false_positives.append(1 - image_true_positives)
+                true_positives.append(image_true_positives)
 
-                    if max_overlap >= self._iou_threshold and assigned_annotation not in detected_annotations:
-                        false_positives = np.append(false_positives, 0)
-                        true_positives = np.append(true_positives, 1)
-                        detected_annotations.append(assigned_annotation)
-                    else:
-                        false_positives = np.append(false_positives, 1)
-                        true_positives = np.append(true_positives, 0)
+            false_positives = np.concatenate(false_positives) if len(false_positives) > 0 else np.zeros((0,))
+            true_positives = np.concatenate(true_positives) if len(true_positives) > 0 else np.zeros((0,))
+            scores = np.concatenate(scores) if len(scores) > 0 else np.zeros((0,))
 
             # no annotations -> AP for this class is 0 (is this correct?)
             if num_annotations == 0:
@@ -171,3 +161,25 @@ class MapEvaluation(keras.callbacks.Callback):
             average_precisions[label] = average_precision
 
         return average_precisions
+
+    def _gather_image(self, i, raw_image, pred_boxes, all_detections, all_annotations):
+        raw_height, raw_width = raw_image.shape[:2]
+
+        if not isinstance(pred_boxes, Detections):
+            pred_boxes = Detections.from_boundboxes(pred_boxes)
+
+        # sort the boxes and the labels according to scores
+        pred_boxes = pred_boxes.sort()
+        pred_labels = pred_boxes.labels
+        pred_boxes = np.concatenate([pred_boxes.to_pixels(raw_width, raw_height),
+                                     pred_boxes.scores[:, np.newaxis]], axis=1)
+
+        # copy detections to all_detections
+        for label in range(self._generator.num_classes()):
+            all_detections[i][label] = pred_boxes[pred_labels == label, :]
+
+        boxes, class_ids = self._generator.load_boxes(i)
+
+        # copy ground truth to all_annotations
+        for label in range(self._generator.num_classes()):
+            all_annotations[i][label] = boxes[class_ids == label].astype(np.float64)
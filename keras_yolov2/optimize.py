@@ -0,0 +1,112 @@
+from keras.models import Model
+from keras.layers import Input, Conv2D, DepthwiseConv2D, BatchNormalization
+import numpy as np
+
+
+def fold_batch_normalization(model):
+    """
+    Rebuild a model where every batch normalization following a convolution is merged into the kernel and the bias of
+    that convolution, nested models (e.g. the feature extractor) are rebuilt the same way. The other layers are
+    reused, so they share their weights with the original model. The folded model is only meant for inference.
+    :param model: keras functional model
+    :return: keras model without the folded batch normalizations
+    """
+    folded_pairs = _find_foldable_pairs(model)
+
+    input_tensors = [Input(batch_shape=layer.batch_input_shape, dtype=layer.dtype, sparse=layer.sparse,
+                           name=layer.name)
+                     for layer in model._input_layers]
+    tensor_map = dict(zip(model.inputs, input_tensors))
+    folded_convs = {bn: conv for conv, bn in folded_pairs.items()}
+
+    # the nodes with the highest depth are the closest to the inputs
+    for depth in sorted(model._nodes_by_depth.keys(), reverse=True):
+        for node in model._nodes_by_depth[depth]:
+            layer = node.outbound_layer
+            if layer in model._input_layers:
+                continue
+
+            inputs = [tensor_map[x] for x in node.input_tensors]
+            if layer in folded_convs:
+                # the convolution already applied this batch normalization
+                tensor_map[node.output_tensors[0]] = inputs[0]
+                continue
+
+            if layer in folded_pairs:
+                new_layer = _fold_conv(layer)
+            elif isinstance(layer, Model):
+                new_layer = fold_batch_normalization(layer)
+            else:
+                new_layer = layer
+
+            kwargs = node.arguments if node.arguments else {}
+            outputs = new_layer(inputs[0] if len(inputs) == 1 else inputs, **kwargs)
+            if layer in folded_pairs:
+                # the weights can only be set once the new layer is built
+                new_layer.set_weights(_folded_weights(layer, folded_pairs[layer]))
+
+            if not isinstance(outputs, list):
+                outputs = [outputs]
+            for x, new_x in zip(node.output_tensors, outputs):
+                tensor_map[x] = new_x
+
+    return Model(input_tensors, [tensor_map[x] for x in model.outputs], name=model.name)
+
+
+def _find_foldable_pairs(model):
+    """
+    :return: dict mapping each convolution of the model to the batch normalization it can absorb
+    """
+    pairs = {}
+    for layer in model.layers:
+        if not isinstance(layer, BatchNormalization) or len(layer._inbound_nodes) != 1:
+            continue
+        if layer.axis not in (-1, 3):
+            continue
+
+        inbound_layers = layer._inbound_nodes[0].inbound_layers
+        if len(inbound_layers) != 1:
+            continue
+        conv = inbound_layers[0]
+
+        # the convolution output must only feed this batch normalization, without activation in between
+        if not isinstance(conv, Conv2D) or conv.data_format != 'channels_last':
+            continue
+        if conv.get_config()['activation'] != 'linear':
+            continue
+        if len(conv._inbound_nodes) != 1 or len(conv._outbound_nodes) != 1:
+            continue
+
+        pairs[conv] = layer
+    return pairs
+
+
+def _fold_conv(conv):
+    config = conv.get_config()
+    config['use_bias'] = True
+    return conv.__class__.from_config(config)
+
+
+def _folded_weights(conv, bn):
+    """
+    With std = sqrt(variance + epsilon), the batch normalization computes gamma * (conv(x) + bias - mean) / std + beta,
+    which is a convolution with the kernel scaled by gamma / std and the bias beta + (bias - mean) * gamma / std.
+    """
+    conv_weights = conv.get_weights()
+    kernel = conv_weights[0]
+    bn_weights = bn.get_weights()
+    nb_channels = bn_weights[-1].shape[0]
+    bias = conv_weights[1] if conv.use_bias else np.zeros(nb_channels, dtype=kernel.dtype)
+
+    gamma = bn_weights.pop(0) if bn.scale else np.ones(nb_channels, dtype=kernel.dtype)
+    beta = bn_weights.pop(0) if bn.center else np.zeros(nb_channels, dtype=kernel.dtype)
+    mean, variance = bn_weights
+
+    factor = gamma / np.sqrt(variance + bn.epsilon)
+    if isinstance(conv, DepthwiseConv2D):
+        # kernel (h, w, in_channels, depth_multiplier), output channel i * depth_multiplier + j
+        kernel = kernel * factor.reshape(kernel.shape[2], kernel.shape[3])
+    else:
+        kernel = kernel * factor
+
+    return [kernel.astype(conv_weights[0].dtype), (beta + (bias - mean) * factor).astype(conv_weights[0].dtype)]
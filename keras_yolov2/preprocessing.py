@@ -1,6 +1,9 @@
-import copy
+import csv
 import os
+import struct
 import xml.etree.ElementTree as et
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context
 
 import cv2
 import numpy as np
@@ -9,129 +12,421 @@ from imgaug.augmentables import BoundingBox, BoundingBoxesOnImage
 from keras.utils import Sequence
 from tqdm import tqdm
 
-from .utils import BoundBox, bbox_iou
+from .annotation_cache import cache_path, file_signature, load_cache, save_cache
+from .annotation_table import AnnotationTable
+from .utils import BoundBox
 
+# start of frame markers of the jpg format, except the ones used for other purposes (0xc4, 0xc8 and 0xcc)
+_JPEG_START_OF_FRAME = {0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf}
 
-def parse_annotation_xml(ann_dir, img_dir, labels=[]):
-    # This parser is utilized on VOC dataset
-    all_imgs = []
-    seen_labels = {}
-
-    ann_files = os.listdir(ann_dir)
-    for ann in tqdm(sorted(ann_files)):
-        img = {'object': []}
-
-        tree = et.parse(os.path.join(ann_dir, ann))
-
-        for elem in tree.iter():
-            if 'filename' in elem.tag:
-                img['filename'] = os.path.join(img_dir, elem.text)
-            if 'width' in elem.tag:
-                img['width'] = int(elem.text)
-            if 'height' in elem.tag:
-                img['height'] = int(elem.text)
-            if 'object' in elem.tag or 'part' in elem.tag:
-                obj = {}
-
-                for attr in list(elem):
-                    if 'name' in attr.tag:
-                        obj['name'] = attr.text
-
-                        if obj['name'] in seen_labels:
-                            seen_labels[obj['name']] += 1
-                        else:
-                            seen_labels[obj['name']] = 1
-
-                        if len(labels) > 0 and obj['name'] not in labels:
-                            break
-                        else:
-                            img['object'] += [obj]
-
-                    if 'bndbox' in attr.tag:
-                        for dim in list(attr):
-                            if 'xmin' in dim.tag:
-                                obj['xmin'] = int(round(float(dim.text)))
-                            if 'ymin' in dim.tag:
-                                obj['ymin'] = int(round(float(dim.text)))
-                            if 'xmax' in dim.tag:
-                                obj['xmax'] = int(round(float(dim.text)))
-                            if 'ymax' in dim.tag:
-                                obj['ymax'] = int(round(float(dim.text)))
-
-        if len(img['object']) > 0:
-            all_imgs += [img]
+# number of xml files given to a worker at once
+_XML_CHUNK_SIZE = 256
+_XML_TAGS = {'filename', 'width', 'height', 'object', 'part'}
+# number of csv images whose size is read at once
+_CSV_BATCH_SIZE = 256
 
-    return all_imgs, seen_labels
 
+def parse_annotation_xml(ann_dir, img_dir, labels=[], cache_dir='', workers=None, as_table=False):
+    """
+    :param cache_dir: optional folder where the parsed annotations are kept between runs, only the files modified since
+                      the last run are parsed again
+    :param workers: number of processes parsing the files, all the cpus by default
+    :param as_table: if True the images are returned as an AnnotationTable, built while the files are parsed
+    """
+    # This parser is utilized on VOC dataset
+    seen_labels = {}
+    images = iter_annotation_xml(ann_dir, img_dir, labels, cache_dir, workers, seen_labels)
+
+    if as_table:
+        return AnnotationTable.from_images(images, labels), seen_labels
+    return list(images), seen_labels
+
+
+def iter_annotation_xml(ann_dir, img_dir, labels=[], cache_dir='', workers=None, seen_labels=None):
+    """
+    Parse the xml files of a folder and yield their images in the order of the file names. Without cache_dir the
+    images are yielded as soon as the workers parse them, instead of being kept until the last file.
+    :param seen_labels: optional dict, the count of each label is added to it as the files are read
+    :return: generator of images in the format of parse_annotation_xml, the files without object are skipped
+    """
+    if seen_labels is None:
+        seen_labels = {}
+
+    ann_files = sorted(os.listdir(ann_dir))
+
+    # the files are only stat'ed when they can be found in the cache
+    signatures = [None] * len(ann_files)
+    cached_files = {}
+    if cache_dir != '':
+        signatures = [file_signature(os.path.join(ann_dir, ann)) for ann in ann_files]
+        cache_file = cache_path(cache_dir, 'xml', [ann_dir, img_dir], labels)
+        cached_files = load_cache(cache_file) or {}
+
+    to_parse = [i for i, (ann, signature) in enumerate(zip(ann_files, signatures))
+                if ann not in cached_files or cached_files[ann][0] != signature]
+
+    chunks = [to_parse[start:start + _XML_CHUNK_SIZE] for start in range(0, len(to_parse), _XML_CHUNK_SIZE)]
+    tasks = [([os.path.join(ann_dir, ann_files[i]) for i in chunk], img_dir, labels) for chunk in chunks]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+
+    new_cached_files = {}
+    # a few files are parsed faster than a pool starts, spawn so the workers never inherit the tensorflow state of
+    # this process
+    pool = get_context('spawn').Pool(workers) if workers > 1 else None
+    try:
+        # imap gives the chunks back in order, so the output does not depend on the number of workers
+        chunk_results = pool.imap(_parse_xml_chunk, tasks) if pool is not None else map(_parse_xml_chunk, tasks)
+        parsed_results = (result for chunk_result in chunk_results for result in chunk_result)
+
+        with tqdm(total=len(to_parse)) as progress:
+            for ann, signature in zip(ann_files, signatures):
+                if ann in cached_files and cached_files[ann][0] == signature:
+                    result = cached_files[ann][1]
+                else:
+                    result = next(parsed_results)
+                    progress.update(1)
+                if cache_dir != '':
+                    new_cached_files[ann] = (signature, result)
+
+                img, file_labels = result
+                for name, count in file_labels.items():
+                    seen_labels[name] = seen_labels.get(name, 0) + count
+                if img is not None:
+                    yield img
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    # a warm start with no file added, modified or removed does not write the cache again
+    if cache_dir != '' and (len(to_parse) > 0 or len(cached_files) != len(ann_files)):
+        save_cache(cache_file, new_cached_files)
+
+
+def _parse_xml_chunk(task):
+    ann_paths, img_dir, labels = task
+    return [_parse_xml_file(ann_path, img_dir, labels) for ann_path in ann_paths]
+
+
+def _parse_xml_file(ann_path, img_dir, labels):
+    """
+    :return: the image, None if it has no object left after the label filter, and the count of each label seen in the
+             file
+    """
+    img = {'object': []}
+    seen_labels = {}
 
-def parse_annotation_csv(csv_file, labels=[], base_path=""):
+    for elem in et.parse(ann_path).iter():
+        tag = _local_tag(elem.tag)
+        if tag not in _XML_TAGS:
+            continue
+
+        if tag == 'filename':
+            img['filename'] = os.path.join(img_dir, elem.text)
+        elif tag == 'width':
+            img['width'] = int(elem.text)
+        elif tag == 'height':
+            img['height'] = int(elem.text)
+        else:
+            name, obj = _parse_xml_object(elem, labels)
+            if name is None:
+                continue
+            seen_labels[name] = seen_labels.get(name, 0) + 1
+            if obj is not None:
+                img['object'] += [obj]
+
+    if len(img['object']) == 0:
+        return None, seen_labels
+    return img, seen_labels
+
+
+def _parse_xml_object(elem, labels):
+    """
+    :return: the name of the object, None if it has none, and the object, None if it has no name or the label filter
+             removes it
+    """
+    obj = {}
+    name = None
+
+    for attr in elem:
+        tag = _local_tag(attr.tag)
+        if tag == 'name':
+            name = obj['name'] = attr.text
+            if len(labels) > 0 and name not in labels:
+                return name, None
+        elif tag == 'bndbox':
+            for dim in attr:
+                dim_tag = _local_tag(dim.tag)
+                if dim_tag in ('xmin', 'ymin', 'xmax', 'ymax'):
+                    obj[dim_tag] = int(round(float(dim.text)))
+
+    return name, obj if name is not None else None
+
+
+def _local_tag(tag):
+    # the tags of a file with a namespace start with it, like {namespace}object
+    return tag.rpartition('}')[2]
+
+
+def parse_annotation_csv(csv_file, labels=[], base_path="", workers=16, cache_dir='', as_table=False):
+    """
+    :param cache_dir: optional folder where the parsed annotations are kept between runs, the csv file is parsed again
+                      only when it changes
+    :param as_table: if True the images are returned as an AnnotationTable, without cache_dir it is built while the
+                     file is read
+    """
     # This is a generic parser that uses CSV files
     # File_path,xmin,ymin,xmax,ymax,class
 
+    if cache_dir != '':
+        cache_file = cache_path(cache_dir, 'csv', [csv_file, base_path], labels)
+        signature = file_signature(csv_file)
+        cached = load_cache(cache_file)
+        if cached is not None and cached[0] == signature:
+            all_imgs, seen_labels = cached[1], cached[2]
+        else:
+            all_imgs, seen_labels = parse_annotation_csv(csv_file, labels, base_path, workers)
+            save_cache(cache_file, (signature, all_imgs, seen_labels))
+
+        if as_table:
+            return AnnotationTable.from_images(all_imgs, labels), seen_labels
+        return all_imgs, seen_labels
+
     print("parsing {} csv file can took a while, wait please.".format(csv_file))
-    all_imgs = []
     seen_labels = {}
 
+    if as_table:
+        images = tqdm(iter_annotation_csv(csv_file, labels, base_path, workers, seen_labels), unit=' images')
+        return AnnotationTable.from_images(images, labels).merge_duplicates(), seen_labels
+
+    all_imgs = []
+
+    # the rows of an image are usually consecutive, the ones coming later are merged into the first group
     all_imgs_indices = {}
-    count_indice = 0
-    with open(csv_file, "r") as annotations:
-        annotations = annotations.read().split("\n")
-        for i, line in enumerate(tqdm(annotations)):
-            if line == "":
+    for img in tqdm(iter_annotation_csv(csv_file, labels, base_path, workers, seen_labels), unit=' images'):
+        if img['filename'] in all_imgs_indices:
+            all_imgs[all_imgs_indices[img['filename']]]['object'] += img['object']
+        else:
+            all_imgs_indices[img['filename']] = len(all_imgs)
+            all_imgs.append(img)
+
+    return all_imgs, seen_labels
+
+
+def iter_annotation_csv(csv_file, labels=[], base_path="", workers=16, seen_labels=None):
+    """
+    Read a csv file row by row and yield its images as soon as their rows are read, only the size of each file is kept
+    in memory, so each image is probed and reported once.
+    Each group of consecutive rows of the same image is yielded as one image, a line without class is a background
+    image.
+    :param csv_file: file with the rows File_path,xmin,ymin,xmax,ymax,class, the paths can be quoted
+    :param labels: only the objects of these labels are kept, all of them if empty
+    :param base_path: folder the paths of the csv file are relative to
+    :param workers: number of threads reading the size of the images
+    :param seen_labels: optional dict, the count of each label is added to it as the images are yielded
+    :return: generator of images in the format of parse_annotation_csv, the missing and corrupt images are skipped
+    """
+    if seen_labels is None:
+        seen_labels = {}
+
+    nb_bad_images = 0
+    bad_images = []
+    # size or error of each file, the rows of an image which are not consecutive do not probe it again
+    sizes = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # read the size of the images by batches, from their header
+        for batch in _batches(_group_csv_rows(csv_file, labels, base_path), _CSV_BATCH_SIZE):
+            fnames = list(dict.fromkeys(img['filename'] for img in batch if img['filename'] not in sizes))
+
+            for fname, size in zip(fnames, executor.map(_probe_image_size, fnames)):
+                sizes[fname] = size
+                if not isinstance(size, tuple):
+                    nb_bad_images += 1
+                    if len(bad_images) < 20:
+                        bad_images.append((fname, size))
+
+            for img in batch:
+                size = sizes[img['filename']]
+                if not isinstance(size, tuple):
+                    continue
+
+                img['width'] = size[1]
+                img['height'] = size[0]
+                for obj in img['object']:
+                    seen_labels[obj['name']] = seen_labels.get(obj['name'], 0) + 1
+                yield img
+
+    if nb_bad_images > 0:
+        print("{} images are missing or corrupt, their annotations were skipped:".format(nb_bad_images))
+        for fname, error in bad_images:
+            print("    {}: {}".format(fname, error))
+        if nb_bad_images > len(bad_images):
+            print("    ...")
+
+
+def _group_csv_rows(csv_file, labels, base_path):
+    """
+    :return: generator of the images of consecutive rows, without their size
+    """
+    img = None
+
+    with open(csv_file, "r", newline="") as annotations:
+        reader = csv.reader(annotations)
+        for row in reader:
+            if len(row) == 0:
                 continue
             try:
-                fname, xmin, ymin, xmax, ymax, obj_name = line.strip().split(",")
+                fname, xmin, ymin, xmax, ymax, obj_name = [field.strip() for field in row]
                 fname = os.path.join(base_path, fname)
 
-                image = cv2.imread(fname)
-                height, width, _ = image.shape
-
-                img = dict()
-                img['object'] = []
-                img['filename'] = fname
-                img['width'] = width
-                img['height'] = height
-
                 if obj_name == "":  # if the object has no name, this means that this image is a background image
-                    all_imgs_indices[fname] = count_indice
-                    all_imgs.append(img)
-                    count_indice += 1
+                    if img is not None:
+                        yield img
+                    img = {'object': [], 'filename': fname}
                     continue
 
-                obj = dict()
-                obj['xmin'] = int(xmin)
-                obj['xmax'] = int(xmax)
-                obj['ymin'] = int(ymin)
-                obj['ymax'] = int(ymax)
-                obj['name'] = obj_name
-
                 if len(labels) > 0 and obj_name not in labels:
                     continue
-                else:
-                    img['object'].append(obj)
 
-                if fname not in all_imgs_indices:
-                    all_imgs_indices[fname] = count_indice
-                    all_imgs.append(img)
-                    count_indice += 1
-                else:
-                    all_imgs[all_imgs_indices[fname]]['object'].append(obj)
+                obj = {'xmin': int(xmin), 'xmax': int(xmax), 'ymin': int(ymin), 'ymax': int(ymax), 'name': obj_name}
 
-                if obj_name not in seen_labels:
-                    seen_labels[obj_name] = 1
-                else:
-                    seen_labels[obj_name] += 1
+                if img is None or img['filename'] != fname:
+                    if img is not None:
+                        yield img
+                    img = {'object': [], 'filename': fname}
+                img['object'].append(obj)
 
-            except:
-                print("Exception occured at line {} from {}".format(i + 1, csv_file))
+            except ValueError:
+                print("Exception occured at line {} from {}".format(reader.line_num, csv_file))
                 raise
-    return all_imgs, seen_labels
+
+    if img is not None:
+        yield img
+
+
+def _batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def _probe_image_size(fname):
+    """
+    :return: (height, width) of the image, or a string with the reason it could not be read
+    """
+    try:
+        size = read_image_size(fname)
+    except (OSError, ValueError) as e:
+        return str(e)
+
+    if size is None:
+        # not a jpg or png file, decode it
+        image = cv2.imread(fname)
+        if image is None:
+            return "unable to decode the image"
+        size = image.shape[:2]
+    return size
+
+
+def read_image_size(fname):
+    """
+    Read the size of a JPEG or PNG image from its header, without decoding the image.
+    :param fname: path of the image
+    :return: (height, width), or None for the other formats
+    """
+    with open(fname, 'rb') as image_file:
+        header = image_file.read(26)
+
+        if header[:8] == b'\x89PNG\r\n\x1a\n':
+            if len(header) < 24 or header[12:16] != b'IHDR':
+                raise ValueError("truncated png header")
+            width, height = struct.unpack('>II', header[16:24])
+            return height, width
+
+        if header[:2] != b'\xff\xd8':
+            return None
+
+        # walk the jpg segments until the start of frame, which holds the size
+        image_file.seek(2)
+        orientation = 1
+        while True:
+            byte = image_file.read(1)
+            while byte == b'\xff':
+                byte = image_file.read(1)
+            if byte == b'':
+                raise ValueError("truncated jpg file, no start of frame found")
+
+            marker = byte[0]
+            if marker == 0x01 or 0xd0 <= marker <= 0xd8:
+                # markers without segment
+                continue
+            if marker == 0xd9 or marker == 0xda:
+                raise ValueError("corrupt jpg file, no start of frame before the image data")
+
+            segment = image_file.read(2)
+            if len(segment) < 2:
+                raise ValueError("truncated jpg file")
+            length = struct.unpack('>H', segment)[0]
+
+            if marker in _JPEG_START_OF_FRAME:
+                frame = image_file.read(5)
+                if len(frame) < 5:
+                    raise ValueError("truncated jpg file")
+                height, width = struct.unpack('>HH', frame[1:5])
+                # cv2.imread rotates the images following their exif orientation, 5 to 8 swap width and height
+                if orientation >= 5:
+                    return width, height
+                return height, width
+
+            if marker == 0xe1:
+                orientation = _exif_orientation(image_file.read(length - 2)) or orientation
+            else:
+                image_file.seek(length - 2, 1)
+
+
+def _exif_orientation(segment):
+    """
+    :param segment: content of a jpg APP1 segment
+    :return: the exif orientation, or None if the segment has none
+    """
+    if segment[:6] != b'Exif\x00\x00' or len(segment) < 14:
+        return None
+
+    tiff = segment[6:]
+    endian = '<' if tiff[:2] == b'II' else '>'
+    ifd_offset = struct.unpack(endian + 'I', tiff[4:8])[0]
+    if ifd_offset + 2 > len(tiff):
+        return None
+
+    nb_entries = struct.unpack(endian + 'H', tiff[ifd_offset:ifd_offset + 2])[0]
+    for i in range(nb_entries):
+        entry = tiff[ifd_offset + 2 + 12 * i:ifd_offset + 14 + 12 * i]
+        if len(entry) < 12:
+            break
+        if struct.unpack(endian + 'H', entry[:2])[0] == 0x0112:
+            return struct.unpack(endian + 'H', entry[8:10])[0]
+    return None
 
 
 class BatchGenerator(Sequence):
     def __init__(self, images, config, shuffle=True, jitter=True, norm=None, callback=None):
-
-        self._images = images
+        """
+        :param images: AnnotationTable, or list of images in the format returned by the annotation parsers
+        :param callback: optional function called with the image and a dict of its annotations, in the format returned
+                         by the annotation parsers, it returns them changed
+        """
+        if not isinstance(images, AnnotationTable):
+            images = AnnotationTable.from_images(images, config['LABELS'])
+
+        self._annotations = images
+        # the batches follow this order, so shuffling does not move the annotations
+        self._order = np.arange(len(images))
+        self._class_ids = images.class_ids_for(list(config['LABELS']))
         self._config = config
 
         self._shuffle = shuffle
@@ -201,35 +496,41 @@ class BatchGenerator(Sequence):
         )
 
         if shuffle:
-            np.random.shuffle(self._images)
+            np.random.shuffle(self._order)
 
     def __len__(self):
-        return int(np.ceil(float(len(self._images)) / self._config['BATCH_SIZE']))
+        return int(np.ceil(float(len(self._order)) / self._config['BATCH_SIZE']))
 
     def num_classes(self):
         return len(self._config['LABELS'])
 
     def size(self):
-        return len(self._images)
+        return len(self._order)
 
-    def load_annotation(self, i):
-        annots = []
-
-        for obj in self._images[i]['object']:
-            annot = [obj['xmin'], obj['ymin'], obj['xmax'], obj['ymax'], self._config['LABELS'].index(obj['name'])]
-            annots += [annot]
+    def batch_size(self):
+        return self._config['BATCH_SIZE']
 
-        if len(annots) == 0:
-            annots = [[]]
+    def load_boxes(self, i):
+        """
+        :return: the boxes of the image i and the index of their class in the labels of the config, -1 for the classes
+                 not in them
+        """
+        boxes, class_ids = self._annotations.image_boxes(self._order[i])
+        return boxes, self._class_ids[class_ids]
 
-        return np.array(annots)
+    def load_annotation(self, i):
+        boxes, class_ids = self.load_boxes(i)
+        if len(boxes) == 0:
+            return np.array([[]])
+        return np.concatenate([boxes, class_ids[:, np.newaxis]], axis=1)
 
     def load_image(self, i):
+        filename = self._annotations.filenames[self._order[i]]
         if self._config['IMAGE_C'] == 1:
-            image = cv2.imread(self._images[i]['filename'], cv2.IMREAD_GRAYSCALE)
+            image = cv2.imread(filename, cv2.IMREAD_GRAYSCALE)
             image = image[..., np.newaxis]
         elif self._config['IMAGE_C'] == 3:
-            image = cv2.imread(self._images[i]['filename'])
+            image = cv2.imread(filename)
         else:
             raise ValueError("Invalid number of image channels.")
         return image
@@ -238,8 +539,8 @@ class BatchGenerator(Sequence):
         l_bound = idx * self._config['BATCH_SIZE']
         r_bound = (idx + 1) * self._config['BATCH_SIZE']
 
-        if r_bound > len(self._images):
-            r_bound = len(self._images)
+        if r_bound > len(self._order):
+            r_bound = len(self._order)
             l_bound = r_bound - self._config['BATCH_SIZE']
 
         instance_count = 0
@@ -251,60 +552,49 @@ class BatchGenerator(Sequence):
         y_batch = np.zeros((r_bound - l_bound, self._config['GRID_H'], self._config['GRID_W'], self._config['BOX'],
                             4 + 1 + len(self._config['LABELS'])))  # desired network output
 
-        for train_instance in self._images[l_bound:r_bound]:
-            # augment input image and fix object's position and size
-            img, all_objs = self.aug_image(train_instance, jitter=self._jitter)
-
-            for obj in all_objs:
-                if obj['xmax'] > obj['xmin'] and obj['ymax'] > obj['ymin'] and obj['name'] in self._config['LABELS']:
-                    center_x = .5 * (obj['xmin'] + obj['xmax'])
-                    center_x = center_x / (float(self._config['IMAGE_W']) / self._config['GRID_W'])
-                    center_y = .5 * (obj['ymin'] + obj['ymax'])
-                    center_y = center_y / (float(self._config['IMAGE_H']) / self._config['GRID_H'])
-
-                    grid_x = int(np.floor(center_x))
-                    grid_y = int(np.floor(center_y))
-
-                    if grid_x < self._config['GRID_W'] and grid_y < self._config['GRID_H']:
-                        obj_indx = self._config['LABELS'].index(obj['name'])
-
-                        center_w = (obj['xmax'] - obj['xmin']) / (
-                                    float(self._config['IMAGE_W']) / self._config['GRID_W'])
-                        center_h = (obj['ymax'] - obj['ymin']) / (
-                                    float(self._config['IMAGE_H']) / self._config['GRID_H'])
-
-                        box = [center_x, center_y, center_w, center_h]
-
-                        # find the anchor that best predicts this box
-                        best_anchor = -1
-                        max_iou = -1
+        anchors_w = np.array([anchor.xmax for anchor in self._anchors])
+        anchors_h = np.array([anchor.ymax for anchor in self._anchors])
+        cell_w = float(self._config['IMAGE_W']) / self._config['GRID_W']
+        cell_h = float(self._config['IMAGE_H']) / self._config['GRID_H']
 
-                        shifted_box = BoundBox(0, 0, center_w, center_h)
-
-                        for i in range(len(self._anchors)):
-                            anchor = self._anchors[i]
-                            iou = bbox_iou(shifted_box, anchor)
-
-                            if max_iou < iou:
-                                best_anchor = i
-                                max_iou = iou
-
-                        # assign ground truth x, y, w, h, confidence and class probs to y_batch
-                        y_batch[instance_count, grid_y, grid_x, best_anchor, 0:4] = box
-                        y_batch[instance_count, grid_y, grid_x, best_anchor, 4] = 1.
-                        y_batch[instance_count, grid_y, grid_x, best_anchor, 5 + obj_indx] = 1
+        for index in self._order[l_bound:r_bound]:
+            # augment input image and fix object's position and size
+            img, boxes, class_ids = self.aug_image(index, jitter=self._jitter)
+            labels = np.where(class_ids >= 0, self._class_ids[class_ids], -1)
+
+            valid = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1]) & (labels >= 0)
+            center_x = .5 * (boxes[valid, 0] + boxes[valid, 2]) / cell_w
+            center_y = .5 * (boxes[valid, 1] + boxes[valid, 3]) / cell_h
+            center_w = (boxes[valid, 2] - boxes[valid, 0]) / cell_w
+            center_h = (boxes[valid, 3] - boxes[valid, 1]) / cell_h
+
+            # find the anchor that best predicts each box, the boxes and the anchors are all at the origin
+            intersect = np.minimum(center_w[:, np.newaxis], anchors_w) * np.minimum(center_h[:, np.newaxis], anchors_h)
+            union = (center_w * center_h)[:, np.newaxis] + anchors_w * anchors_h - intersect
+            best_anchors = np.argmax(intersect / union, axis=1)
+
+            for x, y, w, h, best_anchor, obj_indx in zip(center_x, center_y, center_w, center_h, best_anchors,
+                                                         labels[valid]):
+                grid_x = int(np.floor(x))
+                grid_y = int(np.floor(y))
+
+                if grid_x < self._config['GRID_W'] and grid_y < self._config['GRID_H']:
+                    # assign ground truth x, y, w, h, confidence and class probs to y_batch
+                    y_batch[instance_count, grid_y, grid_x, best_anchor, 0:4] = [x, y, w, h]
+                    y_batch[instance_count, grid_y, grid_x, best_anchor, 4] = 1.
+                    y_batch[instance_count, grid_y, grid_x, best_anchor, 5 + obj_indx] = 1
 
             # assign input image to x_batch
             if self._norm is not None:
                 x_batch[instance_count] = self._norm(img)
             else:
                 # plot image and bounding boxes for sanity check
-                for obj in all_objs:
-                    if obj['xmax'] > obj['xmin'] and obj['ymax'] > obj['ymin']:
-                        cv2.rectangle(img[..., ::-1], (obj['xmin'], obj['ymin']), (obj['xmax'], obj['ymax']),
-                                      (255, 0, 0), 3)
-                        cv2.putText(img[..., ::-1], obj['name'], (obj['xmin'] + 2, obj['ymin'] + 12), 0,
-                                    1.2e-3 * img.shape[0], (0, 255, 0), 2)
+                for (xmin, ymin, xmax, ymax), class_id in zip(boxes.tolist(), class_ids.tolist()):
+                    if xmax > xmin and ymax > ymin:
+                        cv2.rectangle(img[..., ::-1], (xmin, ymin), (xmax, ymax), (255, 0, 0), 3)
+                        if class_id >= 0:
+                            cv2.putText(img[..., ::-1], self._annotations.labels[class_id], (xmin + 2, ymin + 12), 0,
+                                        1.2e-3 * img.shape[0], (0, 255, 0), 2)
 
                 x_batch[instance_count] = img
             # increase instance counter in current batch
@@ -314,10 +604,15 @@ class BatchGenerator(Sequence):
 
     def on_epoch_end(self):
         if self._shuffle:
-            np.random.shuffle(self._images)
-
-    def aug_image(self, train_instance, jitter):
-        image_name = train_instance['filename']
+            np.random.shuffle(self._order)
+
+    def aug_image(self, index, jitter):
+        """
+        :param index: index of the image in the annotation table
+        :return: the augmented image resized to the input size, its boxes as an int array of shape (nb_boxes, 4) and
+                 the class id of each box in the annotation table
+        """
+        image_name = self._annotations.filenames[index]
         if self._config['IMAGE_C'] == 1:
             image = cv2.imread(image_name, cv2.IMREAD_GRAYSCALE)
         elif self._config['IMAGE_C'] == 3:
@@ -327,38 +622,32 @@ class BatchGenerator(Sequence):
 
         if image is None:
             print('Cannot find ', image_name)
+
+        boxes, class_ids = self._annotations.image_boxes(index)
         if self._callback is not None:
-            image, train_instance = self._callback(image, train_instance)
+            # the callbacks work on a dict, built for this call only
+            image, train_instance = self._callback(image, self._annotations.image(index))
+            objects = train_instance['object']
+            boxes = np.array([[obj['xmin'], obj['ymin'], obj['xmax'], obj['ymax']] for obj in objects]).reshape(-1, 4)
+            class_ids = np.array([self._annotations.label_map.get(obj['name'], -1) for obj in objects],
+                                 dtype=np.int32)
 
         h = image.shape[0]
         w = image.shape[1]
-        all_objs = copy.deepcopy(train_instance['object'])
 
         if jitter:
-            bbs = []
-            for i, obj in enumerate(all_objs):
-                xmin = obj['xmin']
-                ymin = obj['ymin']
-                xmax = obj['xmax']
-                ymax = obj['ymax']
-                # use label field to later match it with final boxes
-                bbs.append(BoundingBox(x1=xmin, x2=xmax, y1=ymin, y2=ymax, label=i))
+            # use label field to later match it with final boxes
+            bbs = [BoundingBox(x1=xmin, x2=xmax, y1=ymin, y2=ymax, label=i)
+                   for i, (xmin, ymin, xmax, ymax) in enumerate(boxes)]
             bbs = BoundingBoxesOnImage(bbs, shape=image.shape)
             image, bbs = self._aug_pipe(image=image, bounding_boxes=bbs)
             bbs = bbs.remove_out_of_image().clip_out_of_image()
 
-            if len(bbs) < len(all_objs):
+            if len(bbs) < len(boxes):
                 print("Some boxes were removed during augmentations.")
 
-            filtered_objs = []
-            for bb in bbs.bounding_boxes:
-                obj = all_objs[bb.label]
-                obj['xmin'] = bb.x1
-                obj['xmax'] = bb.x2
-                obj['ymin'] = bb.y1
-                obj['ymax'] = bb.y2
-                filtered_objs.append(obj)
-            all_objs = filtered_objs
+            class_ids = class_ids[[bb.label for bb in bbs.bounding_boxes]]
+            boxes = np.array([[bb.x1, bb.y1, bb.x2, bb.y2] for bb in bbs.bounding_boxes]).reshape(-1, 4)
 
         # resize the image to standard size
         image = cv2.resize(image, (self._config['IMAGE_W'], self._config['IMAGE_H']))
@@ -366,13 +655,8 @@ class BatchGenerator(Sequence):
             image = image[..., np.newaxis]
         image = image[..., ::-1]  # make it RGB (it is important for normalization of some backends)
 
-        # fix object's position and size
-        for obj in all_objs:
-            for attr in ['xmin', 'xmax']:
-                obj[attr] = int(obj[attr] * float(self._config['IMAGE_W']) / w)
-                obj[attr] = max(min(obj[attr], self._config['IMAGE_W']), 0)
-
-            for attr in ['ymin', 'ymax']:
-                obj[attr] = int(obj[attr] * float(self._config['IMAGE_H']) / h)
-                obj[attr] = max(min(obj[attr], self._config['IMAGE_H']), 0)
-        return image, all_objs
+        # fix object's position and size, a new array so the annotation table is not changed
+        input_size = np.array([self._config['IMAGE_W'], self._config['IMAGE_H']] * 2)
+        boxes = (boxes * input_size.astype(np.float64) / np.array([w, h] * 2)).astype(np.int64)
+        boxes = np.clip(boxes, 0, input_size)
+        return image, boxes, class_ids
@@ -0,0 +1,203 @@
+from keras.models import Model
+from keras.layers import (Input, Conv2D, DepthwiseConv2D, Dense, BatchNormalization, Activation, MaxPooling2D,
+                          AveragePooling2D, ZeroPadding2D, Dropout, Concatenate)
+from keras.layers.advanced_activations import LeakyReLU
+from keras import backend as K
+import numpy as np
+import time
+import re
+
+# layers working on each channel independently, a subset of channels can go through them
+_CHANNEL_WISE_LAYERS = (BatchNormalization, Activation, LeakyReLU, MaxPooling2D, AveragePooling2D, ZeroPadding2D,
+                        Dropout)
+
+
+def select_channels(model, ratio):
+    """
+    Rank the filters of every prunable conv_i layer by the magnitude of the gamma of its norm_i layer.
+    A convolution is not pruned when its channels reach an output of its model or a layer that needs all of them, like
+    the Lambda of the Full Yolo skip connection.
+    :param model: keras model, nested models like the feature extractor are searched too
+    :param ratio: fraction of the filters to remove from each convolution
+    :return: dict mapping the name of each pruned convolution to the sorted indices of the kept filters
+    """
+    keep = {}
+    for owner in _iter_models(model):
+        for layer in owner.layers:
+            match = re.match(r'conv_(\d+)$', layer.name)
+            if match is None or type(layer) is not Conv2D or not _is_prunable(owner, layer):
+                continue
+            try:
+                norm = owner.get_layer('norm_' + match.group(1))
+            except ValueError:
+                continue
+            if not norm.scale:
+                continue
+
+            gamma = np.abs(norm.get_weights()[0])
+            nb_kept = max(int(round(len(gamma) * (1. - ratio))), 1)
+            keep[layer.name] = np.sort(np.argsort(-gamma)[:nb_kept])
+
+    return keep
+
+
+def prune_model(model, keep):
+    """
+    Build a slimmer copy of a model, without the removed filters of the pruned convolutions and without the matching
+    channels of the following layers, and copy the remaining weights into it.
+    :param model: keras functional model, nested models are pruned too
+    :param keep: dict returned by select_channels
+    :return: keras model with its own layers, it does not share any weight with model
+    """
+    input_tensors = [Input(batch_shape=layer.batch_input_shape, dtype=layer.dtype, sparse=layer.sparse,
+                           name=layer.name)
+                     for layer in model._input_layers]
+    # each tensor of model is mapped to its new tensor and to the indices of the channels it kept, None for all
+    tensor_map = {x: (new_x, None) for x, new_x in zip(model.inputs, input_tensors)}
+
+    # the nodes with the highest depth are the closest to the inputs
+    for depth in sorted(model._nodes_by_depth.keys(), reverse=True):
+        for node in model._nodes_by_depth[depth]:
+            layer = node.outbound_layer
+            if layer in model._input_layers:
+                continue
+
+            inputs = [tensor_map[x][0] for x in node.input_tensors]
+            channels = [tensor_map[x][1] for x in node.input_tensors]
+            kwargs = node.arguments if node.arguments else {}
+
+            new_layer, new_weights, out_channels = _prune_layer(layer, node, channels, keep)
+            outputs = new_layer(inputs[0] if len(inputs) == 1 else inputs, **kwargs)
+            if new_weights is not None:
+                # the weights can only be set once the new layer is built
+                new_layer.set_weights(new_weights)
+
+            if not isinstance(outputs, list):
+                outputs = [outputs]
+            for x, new_x in zip(node.output_tensors, outputs):
+                tensor_map[x] = (new_x, out_channels)
+
+    if any(tensor_map[x][1] is not None for x in model.outputs):
+        raise ValueError("The outputs of {} can't be pruned.".format(model.name))
+
+    return Model(input_tensors, [tensor_map[x][0] for x in model.outputs], name=model.name)
+
+
+def _prune_layer(layer, node, channels, keep):
+    """
+    :return: the layer to call in the pruned model, its weights (None to keep the ones it has) and the channels kept in
+             its output
+    """
+    if isinstance(layer, Model):
+        if any(c is not None for c in channels):
+            raise ValueError("The inputs of the nested model {} can't be pruned.".format(layer.name))
+        return prune_model(layer, keep), None, None
+
+    if type(layer) is Conv2D:
+        in_channels = channels[0]
+        out_channels = keep.get(layer.name)
+
+        config = layer.get_config()
+        if out_channels is not None:
+            config['filters'] = len(out_channels)
+
+        weights = layer.get_weights()
+        if in_channels is not None:
+            weights[0] = weights[0][:, :, in_channels, :]
+        if out_channels is not None:
+            weights = [weights[0][..., out_channels]] + [bias[out_channels] for bias in weights[1:]]
+
+        return Conv2D.from_config(config), weights, out_channels
+
+    if isinstance(layer, _CHANNEL_WISE_LAYERS):
+        weights = layer.get_weights()
+        if channels[0] is not None:
+            weights = [weight[channels[0]] for weight in weights]
+        return layer.__class__.from_config(layer.get_config()), weights, channels[0]
+
+    if isinstance(layer, Concatenate) and layer.axis in (-1, 3):
+        out_channels = None
+        if any(c is not None for c in channels):
+            offset = 0
+            out_channels = []
+            for x, c in zip(node.input_tensors, channels):
+                nb_channels = K.int_shape(x)[-1]
+                out_channels.append(offset + (np.arange(nb_channels) if c is None else np.asarray(c)))
+                offset += nb_channels
+            out_channels = np.concatenate(out_channels)
+        return layer, None, out_channels
+
+    if any(c is not None for c in channels):
+        raise ValueError("The layer {} can't follow a pruned convolution.".format(layer.name))
+
+    if len(layer.get_weights()) > 0:
+        # a fresh copy, so the pruned model can be fine-tuned without changing the original one
+        return layer.__class__.from_config(layer.get_config()), layer.get_weights(), None
+
+    return layer, None, None
+
+
+def _is_prunable(model, conv):
+    """
+    Follow the output of conv through the channel-wise layers, it can be pruned if it only reaches convolutions.
+    """
+    pending = [conv]
+    while len(pending) > 0:
+        layer = pending.pop()
+        if any(x is layer.output for x in model.outputs):
+            return False
+
+        for node in layer._outbound_nodes:
+            next_layer = node.outbound_layer
+            if type(next_layer) is Conv2D:
+                continue
+            if isinstance(next_layer, _CHANNEL_WISE_LAYERS) or \
+                    (isinstance(next_layer, Concatenate) and next_layer.axis in (-1, 3)):
+                pending.append(next_layer)
+            else:
+                return False
+
+    return True
+
+
+def _iter_models(model):
+    yield model
+    for layer in model.layers:
+        if isinstance(layer, Model):
+            for nested_model in _iter_models(layer):
+                yield nested_model
+
+
+def count_flops(model):
+    """
+    :return: number of floating point operations of the convolutions and dense layers for one image, a multiply-add
+             counts as two operations
+    """
+    flops = 0
+    for layer in model.layers:
+        if isinstance(layer, Model):
+            flops += count_flops(layer)
+        elif isinstance(layer, (Conv2D, DepthwiseConv2D)):
+            # each output pixel costs one multiply-add per kernel weight
+            out_h, out_w = layer.output_shape[1:3]
+            flops += 2 * out_h * out_w * int(np.prod(K.int_shape(layer.weights[0])))
+        elif isinstance(layer, Dense):
+            flops += 2 * int(np.prod(K.int_shape(layer.kernel)))
+    return flops
+
+
+def measure_latency(model, batch_size=1, iterations=20, warmup=3):
+    """
+    :return: median time in milliseconds of a forward pass on random inputs
+    """
+    inputs = np.random.uniform(size=(batch_size,) + K.int_shape(model.input)[1:]).astype(np.float32)
+    for _ in range(warmup):
+        model.predict_on_batch(inputs)
+
+    times = []
+    for _ in range(iterations):
+        start = time.time()
+        model.predict_on_batch(inputs)
+        times.append(time.time() - start)
+
+    return float(np.median(times)) * 1000
@@ -0,0 +1,91 @@
+from .utils import decode_netout, preprocess_image
+import tensorflow as tf
+import numpy as np
+import tempfile
+import os
+
+
+def convert_to_int8(yolo, generator, output_path, nb_samples=100):
+    """
+    Post-training quantization of a YOLO model into an int8 TFLite model.
+    :param yolo: YOLO object with the weights already loaded
+    :param generator: BatchGenerator without jitter, its images are the representative dataset used to calibrate the
+                      activation ranges
+    :param output_path: path of the .tflite file
+    :param nb_samples: maximum number of images used for the calibration
+    """
+    def representative_dataset():
+        count = 0
+        for i in range(len(generator)):
+            x_batch, _ = generator[i]
+            for image in x_batch:
+                if count >= nb_samples:
+                    return
+                count += 1
+                yield [image[np.newaxis].astype(np.float32)]
+
+    # the TF 1.x converter reads the keras model from a file, the Lambda layers of the Full Yolo backend and of the
+    # flexible input models need tf to be loaded again
+    model_file = tempfile.NamedTemporaryFile(suffix='.h5', delete=False)
+    model_file.close()
+    try:
+        yolo.get_inference_model().save(model_file.name)
+        converter = tf.lite.TFLiteConverter.from_keras_model_file(model_file.name, custom_objects={'tf': tf})
+    finally:
+        os.remove(model_file.name)
+
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = tf.lite.RepresentativeDataset(representative_dataset)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    tflite_model = converter.convert()
+    with open(output_path, 'wb') as tflite_file:
+        tflite_file.write(tflite_model)
+
+
+class TFLiteYOLO(object):
+    """
+    Predictor running a TFLite model, with the same prediction API as YOLO, so it can be used in its place, e.g. in
+    MapEvaluation.
+
+    # Arguments
+        model_path : path of the .tflite file.
+        labels     : list of labels.
+        anchors    : list with the anchors in the format [w0, h0, w1, h1, ...].
+        normalize  : normalization function of the feature extractor used to train the model.
+        gray_mode  : True if the model expects grayscale images.
+    """
+
+    def __init__(self, model_path, labels, anchors, normalize, gray_mode=False):
+        self.labels = list(labels)
+        self._nb_class = len(self.labels)
+        self._anchors = anchors
+        self._normalize = normalize
+        self._gray_mode = gray_mode
+
+        self._interpreter = tf.lite.Interpreter(model_path=model_path)
+        self._interpreter.allocate_tensors()
+        self._input_details = self._interpreter.get_input_details()[0]
+        self._output_details = self._interpreter.get_output_details()[0]
+        self._input_size = tuple(self._input_details['shape'][1:])
+
+    def predict(self, image, iou_threshold=0.5, score_threshold=0.5, as_detections=False):
+        input_image = preprocess_image(image, self._input_size, self._normalize, self._gray_mode)
+        input_image = input_image[np.newaxis]
+
+        input_scale, input_zero_point = self._input_details['quantization']
+        if input_scale != 0:
+            input_image = np.round(input_image / input_scale + input_zero_point)
+        self._interpreter.set_tensor(self._input_details['index'], input_image.astype(self._input_details['dtype']))
+        self._interpreter.invoke()
+
+        netout = self._interpreter.get_tensor(self._output_details['index'])[0].astype(np.float32)
+        output_scale, output_zero_point = self._output_details['quantization']
+        if output_scale != 0:
+            netout = (netout - output_zero_point) * output_scale
+
+        return decode_netout(netout, self._anchors, self._nb_class, score_threshold, iou_threshold, as_detections)
+
+    def predict_batch(self, images, batch_size=8, iou_threshold=0.5, score_threshold=0.5, as_detections=False):
+        # the interpreter is allocated for a single image, so the images are predicted one by one
+        return [self.predict(image, iou_threshold, score_threshold, as_detections) for image in images]
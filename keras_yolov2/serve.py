@@ -0,0 +1,283 @@
+"""
+Asyncio HTTP server with dynamic micro-batching.
+
+    python -m keras_yolov2.serve -c config.json -w weights.h5 --port 8080
+
+    POST /predict  body: an encoded image (jpg, png, ...)  ->  {"detections": [{"label", "score", "box"}, ...]}
+    GET  /stats    ->  queue depth and batch size statistics
+"""
+from .utils import get_session
+from .frontend import YOLO
+from concurrent.futures import ThreadPoolExecutor
+import tensorflow as tf
+import numpy as np
+import argparse
+import asyncio
+import keras
+import json
+import time
+import cv2
+
+_STATUS_MESSAGES = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                    500: 'Internal Server Error'}
+
+
+class MicroBatcher(object):
+    """
+    Queue the submitted images and predict them in batches, a batch is closed when it reaches max_batch_size or when
+    its first image has waited max_wait_ms.
+
+    # Arguments
+        predict_fn     : function receiving a list of images and returning a list with their detections, it runs in
+                         a dedicated thread.
+        max_batch_size : maximum number of images per forward pass.
+        max_wait_ms    : maximum time the first image of a batch waits for other images.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=5.):
+        self._predict_fn = predict_fn
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._queue = None
+        self._task = None
+
+        self.requests = 0
+        self.batches = 0
+        self.batch_sizes = {}
+
+    def start(self):
+        # the queue must be created inside the running loop
+        self._queue = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._executor.shutdown()
+
+    def queue_depth(self):
+        return 0 if self._queue is None else self._queue.qsize()
+
+    async def submit(self, image):
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((image, future))
+        self.requests += 1
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._max_wait
+
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            images = [image for image, _ in batch]
+            self.batches += 1
+            self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+
+            try:
+                results = await loop.run_in_executor(self._executor, self._predict_fn, images)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        return {'queue_depth': self.queue_depth(),
+                'requests': self.requests,
+                'batches': self.batches,
+                'mean_batch_size': sum(size * count for size, count in self.batch_sizes.items()) / max(self.batches, 1),
+                'batch_sizes': {str(size): count for size, count in sorted(self.batch_sizes.items())}}
+
+
+class InferenceServer(object):
+    """
+    Minimal HTTP/1.1 server answering each request with JSON and closing the connection.
+
+    # Arguments
+        yolo            : YOLO object used to predict the images.
+        max_batch_size  : maximum number of images per forward pass.
+        max_wait_ms     : maximum time the first image of a batch waits for other images.
+        iou_threshold   : IoU threshold of the non max suppression.
+        score_threshold : minimum score to keep a box.
+    """
+
+    def __init__(self, yolo, max_batch_size=8, max_wait_ms=5., iou_threshold=0.5, score_threshold=0.5):
+        self._yolo = yolo
+        self._iou_threshold = iou_threshold
+        self._score_threshold = score_threshold
+
+        # keras models can only be used from other threads inside the graph they were built in
+        self._graph = tf.get_default_graph()
+        self._yolo.get_inference_model()._make_predict_function()
+
+        self._batcher = MicroBatcher(self._predict, max_batch_size, max_wait_ms)
+        self._server = None
+
+    def _predict(self, images):
+        with self._graph.as_default():
+            return self._yolo.predict_batch(images,
+                                            batch_size=len(images),
+                                            iou_threshold=self._iou_threshold,
+                                            score_threshold=self._score_threshold,
+                                            as_detections=True)
+
+    async def start(self, host='127.0.0.1', port=8080):
+        self._batcher.start()
+        self._server = await asyncio.start_server(self._handle, host, port)
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        await self._batcher.stop()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, path = request_line.decode('latin-1').split(' ')[:2]
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, value = line.decode('latin-1').split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            status, payload = await self._route(method, path, body)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, payload = 400, {'error': str(e)}
+        except Exception as e:
+            status, payload = 500, {'error': str(e)}
+
+        content = json.dumps(payload).encode()
+        writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                     'Connection: close\r\n\r\n'.format(status, _STATUS_MESSAGES[status], len(content)).encode())
+        writer.write(content)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body):
+        if path == '/stats':
+            return 200, self._batcher.stats()
+        if path != '/predict':
+            return 404, {'error': 'unknown path {}'.format(path)}
+        if method != 'POST':
+            return 405, {'error': 'use POST to send an image'}
+
+        loop = asyncio.get_event_loop()
+        image = await loop.run_in_executor(None, cv2.imdecode, np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError('the request body is not a valid image')
+
+        start = time.time()
+        detections = await self._batcher.submit(image)
+        image_h, image_w = image.shape[:2]
+
+        return 200, {'detections': [{'label': self._yolo.labels[label],
+                                     'score': float(score),
+                                     'box': [float(coord) for coord in box]}
+                                    for box, score, label in zip(detections.to_pixels(image_w, image_h),
+                                                                 detections.scores, detections.labels)],
+                     'latency_ms': (time.time() - start) * 1000}
+
+
+argparser = argparse.ArgumentParser(
+    description='Serve a YOLO_v2 model over HTTP with dynamic micro-batching')
+
+argparser.add_argument(
+    '-c',
+    '--conf',
+    default='config.json',
+    help='path to configuration file')
+
+argparser.add_argument(
+    '-w',
+    '--weights',
+    default='',
+    help='path to pretrained weights')
+
+argparser.add_argument(
+    '--host',
+    default='127.0.0.1',
+    help='address to listen on')
+
+argparser.add_argument(
+    '-p',
+    '--port',
+    default=8080,
+    type=int,
+    help='port to listen on')
+
+argparser.add_argument(
+    '-b',
+    '--max_batch_size',
+    default=8,
+    type=int,
+    help='maximum number of images per forward pass')
+
+argparser.add_argument(
+    '-t',
+    '--max_wait_ms',
+    default=5.,
+    type=float,
+    help='maximum time in milliseconds an image waits for a batch to be filled')
+
+
+def _main_(args):
+    keras.backend.tensorflow_backend.set_session(get_session())
+
+    with open(args.conf) as config_buffer:
+        config = json.load(config_buffer)
+
+    weights_path = args.weights
+    if weights_path == '':
+        weights_path = config['train']['saved_weights_name']
+
+    yolo = YOLO(backend=config['model']['backend'],
+                input_size=(config['model']['input_size_h'], config['model']['input_size_w']),
+                labels=config['model']['labels'],
+                anchors=config['model']['anchors'],
+                gray_mode=config['model']['gray_mode'])
+    yolo.load_weights(weights_path)
+
+    server = InferenceServer(yolo,
+                             max_batch_size=args.max_batch_size,
+                             max_wait_ms=args.max_wait_ms,
+                             iou_threshold=config['valid']['iou_threshold'],
+                             score_threshold=config['valid']['score_threshold'])
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(server.start(args.host, args.port))
+    print('Serving on http://{}:{}'.format(args.host, args.port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.stop())
+
+
+if __name__ == '__main__':
+    _args = argparser.parse_args()
+    _main_(_args)
@@ -1,5 +1,3 @@
-from .backend import (TinyYoloFeature, FullYoloFeature, MobileNetFeature, SqueezeNetFeature, Inception3Feature,
-                      VGG16Feature, ResNet50Feature, BaseFeatureExtractor)
 from datetime import datetime
 import tensorflow as tf
 import numpy as np
@@ -10,6 +8,8 @@ import os
 
 
 class BoundBox:
+    __slots__ = ('xmin', 'ymin', 'xmax', 'ymax', 'c', 'classes', 'label', 'score')
+
     def __init__(self, xmin, ymin, xmax, ymax, c=None, classes=None):
         self.xmin = xmin
         self.ymin = ymin
@@ -48,6 +48,86 @@ class BoundBox:
         )
 
 
+class Detections(object):
+    """
+    Columnar container for the detections of one image, a compact alternative to a list of BoundBox.
+    :param boxes: (N, 4) [xmin, ymin, xmax, ymax] relative to the image size
+    :param scores: (N,) score of the label of each box
+    :param labels: (N,) label of each box
+    :param classes: optional (N, nb_class) score of every class of each box
+    """
+    __slots__ = ('boxes', 'scores', 'labels', 'classes')
+
+    def __init__(self, boxes, scores, labels, classes=None):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        self.labels = np.asarray(labels, dtype=np.int32).reshape(-1)
+        self.classes = None if classes is None else np.asarray(classes, dtype=np.float32)
+
+    @classmethod
+    def from_boundboxes(cls, bound_boxes):
+        boxes = [[box.xmin, box.ymin, box.xmax, box.ymax] for box in bound_boxes]
+        scores = [box.get_score() for box in bound_boxes]
+        labels = [box.get_label() for box in bound_boxes]
+
+        classes = None
+        if len(bound_boxes) > 0 and all(box.classes is not None for box in bound_boxes):
+            classes = [box.classes for box in bound_boxes]
+
+        return cls(boxes, scores, labels, classes)
+
+    def to_boundboxes(self):
+        bound_boxes = []
+        for i in range(len(self)):
+            classes = None if self.classes is None else self.classes[i]
+            box = BoundBox(self.boxes[i, 0], self.boxes[i, 1], self.boxes[i, 2], self.boxes[i, 3], self.scores[i],
+                           classes)
+            box.label = self.labels[i]
+            box.score = self.scores[i]
+            bound_boxes.append(box)
+
+        return bound_boxes
+
+    def to_pixels(self, image_w, image_h):
+        """
+        :return: (N, 4) ndarray of [xmin, ymin, xmax, ymax] in pixels
+        """
+        return self.boxes * np.array([image_w, image_h, image_w, image_h], dtype=np.float32)
+
+    def filter(self, score_threshold=None, labels=None):
+        """
+        :param score_threshold: keep only the boxes with score greater than score_threshold
+        :param labels: keep only the boxes with one of these labels
+        :return: new Detections
+        """
+        keep = np.ones(len(self), dtype=bool)
+        if score_threshold is not None:
+            keep &= self.scores > score_threshold
+        if labels is not None:
+            keep &= np.isin(self.labels, labels)
+
+        return self[keep]
+
+    def sort(self):
+        """
+        :return: new Detections sorted by decreasing score
+        """
+        return self[np.argsort(-self.scores, kind='mergesort')]
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            index = [index]
+
+        classes = None if self.classes is None else self.classes[index]
+        return Detections(self.boxes[index], self.scores[index], self.labels[index], classes)
+
+    def __len__(self):
+        return self.scores.shape[0]
+
+    def __repr__(self):
+        return "<Detections({} boxes)>".format(len(self))
+
+
 class WeightReader:
     def __init__(self, weight_file):
         self.offset = 4
@@ -87,71 +167,186 @@ def draw_boxes(image, boxes, labels):
                     continue
                 colors.append((b, g, r))
 
-    for box in boxes:
-        xmin = int(box.xmin * image_w)
-        ymin = int(box.ymin * image_h)
-        xmax = int(box.xmax * image_w)
-        ymax = int(box.ymax * image_h)
+    if not isinstance(boxes, Detections):
+        boxes = Detections.from_boundboxes(boxes)
 
-        line_width_factor = int(min(image_h, image_w)*0.005)
-        cv2.rectangle(image, (xmin, ymin), (xmax, ymax), colors[box.get_label()], line_width_factor*2)
-        cv2.putText(image, "{} {:.3f}".format(labels[box.get_label()], box.get_score()),
+    line_width_factor = int(min(image_h, image_w)*0.005)
+    for (xmin, ymin, xmax, ymax), label, score in zip(boxes.to_pixels(image_w, image_h).astype(int).tolist(),
+                                                      boxes.labels, boxes.scores):
+        cv2.rectangle(image, (xmin, ymin), (xmax, ymax), colors[label], line_width_factor*2)
+        cv2.putText(image, "{} {:.3f}".format(labels[label], score),
                     (xmin, ymin - line_width_factor * 3), cv2.FONT_HERSHEY_PLAIN, 2e-3 * min(image_h, image_w),
                     (0, 255, 0), line_width_factor)
         
     return image      
 
 
-def decode_netout(netout, anchors, nb_class, obj_threshold=0.5, nms_threshold=0.3):
-    grid_h, grid_w, nb_box = netout.shape[:3]
+def preprocess_image(image, input_size, norm, gray_mode=False):
+    """
+    Prepare a BGR or grayscale image to be fed into the network.
+    :param image: ndarray image with any size
+    :param input_size: (height, width, channels) of the network input
+    :param norm: normalization function of the feature extractor
+    :param gray_mode: True if the network expects grayscale images
+    :return: (height, width, channels) normalized image
+    """
+    if len(image.shape) == 3 and gray_mode:
+        if image.shape[2] == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    elif len(image.shape) == 2 and not gray_mode:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+    image = cv2.resize(image, (input_size[1], input_size[0]))
+    if len(image.shape) == 2:
+        image = image[..., np.newaxis]
+    image = image[..., ::-1]  # make it RGB (it is important for normalization of some backends)
+
+    return norm(image)
+
+
+def normalize_image(image, mode):
+    """
+    Normalization of the built-in feature extractors, selected by name, so images can be normalized without building
+    a feature extractor.
+    :param image: RGB image, as returned by preprocess_image before the normalization
+    :param mode: 'scale' to [0, 1], 'symmetric' to [-1, 1] or 'caffe' for the BGR mean subtraction
+    :return: normalized image
+    """
+    if mode == 'scale':
+        return image / 255.
+    if mode == 'symmetric':
+        return (image / 255. - 0.5) * 2.
+    if mode == 'caffe':
+        image = image[..., ::-1].astype('float')
+        image[..., 0] -= 103.939
+        image[..., 1] -= 116.779
+        image[..., 2] -= 123.68
+        return image
+    raise ValueError("Unknown normalization mode {}, it must be 'scale', 'symmetric' or 'caffe'.".format(mode))
+
+
+def decode_netout(netout, anchors, nb_class, obj_threshold=0.5, nms_threshold=0.3, as_detections=False):
+    if as_detections:
+        return Detections(*decode_netout_arrays(netout, anchors, obj_threshold, nms_threshold, with_classes=True))
+
+    boxes, confidence, classes = _decode_netout(netout, anchors, obj_threshold, nms_threshold)
 
-    boxes = []
+    bound_boxes = []
+    for i in range(boxes.shape[0]):
+        box = BoundBox(boxes[i, 0], boxes[i, 1], boxes[i, 2], boxes[i, 3], confidence[i], classes[i])
+        box.get_score()
+        bound_boxes.append(box)
+
+    return bound_boxes
+
+
+def decode_netout_arrays(netout, anchors, obj_threshold=0.5, nms_threshold=0.3, with_classes=False):
+    """
+    Array version of decode_netout, it decodes the whole grid at once and does not modify netout.
+    :param netout: (grid_h, grid_w, nb_box, 4 + 1 + nb_class) ndarray, the raw output of the network
+    :param anchors: list with the anchors in the format [w0, h0, w1, h1, ...]
+    :param obj_threshold: minimum class score to keep a box
+    :param nms_threshold: IoU used to suppress non-maximal boxes
+    :param with_classes: also return the (N, nb_class) ndarray of the score of every class of each box
+    :return: (N, 4) ndarray of [xmin, ymin, xmax, ymax] relative to the image size, (N,) ndarray of scores and
+             (N,) ndarray of labels
+    """
+    boxes, _, classes = _decode_netout(netout, anchors, obj_threshold, nms_threshold)
+    labels = np.argmax(classes, axis=-1)
+    scores = classes[np.arange(classes.shape[0]), labels]
+
+    if with_classes:
+        return boxes, scores, labels, classes
+    return boxes, scores, labels
+
+
+def _decode_netout(netout, anchors, obj_threshold, nms_threshold):
+    boxes, confidence, classes = _decode_grid(netout, anchors, obj_threshold)
+    keep = _suppress_boxes(boxes, classes, obj_threshold, nms_threshold)
+
+    return boxes[keep], confidence[keep], classes[keep]
+
+
+def _decode_grid(netout, anchors, obj_threshold):
+    """
+    :return: boxes, confidences and class scores of the cells with a class score above obj_threshold
+    """
+    grid_h, grid_w, nb_box = netout.shape[:3]
 
     # decode the output by the network
-    netout[..., 4] = _sigmoid(netout[..., 4])
-    netout[..., 5:] = netout[..., 4][..., np.newaxis] * _softmax(netout[..., 5:])
-    netout[..., 5:] *= netout[..., 5:] > obj_threshold
+    confidence = _sigmoid(netout[..., 4])
+    classes = confidence[..., np.newaxis] * _softmax(netout[..., 5:])
+    classes *= classes > obj_threshold
+
+    # from 4th element onwards are confidence and class classes, keep the cells with any class left
+    rows, cols, anchor_ids = np.nonzero(np.sum(classes, axis=-1) > 0)
+    confidence = confidence[rows, cols, anchor_ids]
+    classes = classes[rows, cols, anchor_ids]
 
-    for row in range(grid_h):
-        for col in range(grid_w):
-            for b in range(nb_box):
-                # from 4th element onwards are confidence and class classes
-                classes = netout[row, col, b, 5:]
+    # first 4 elements are x, y, w, and h
+    x, y, w, h = np.transpose(netout[rows, cols, anchor_ids, :4])
+    anchors = np.reshape(anchors, (nb_box, 2))
 
-                if np.sum(classes) > 0:
-                    # first 4 elements are x, y, w, and h
-                    x, y, w, h = netout[row, col, b, :4]
+    x = (cols + _sigmoid(x)) / grid_w  # center position, unit: image width
+    y = (rows + _sigmoid(y)) / grid_h  # center position, unit: image height
+    w = anchors[anchor_ids, 0] * np.exp(w) / grid_w  # unit: image width
+    h = anchors[anchor_ids, 1] * np.exp(h) / grid_h  # unit: image height
 
-                    x = (col + _sigmoid(x)) / grid_w  # center position, unit: image width
-                    y = (row + _sigmoid(y)) / grid_h  # center position, unit: image height
-                    w = anchors[2 * b + 0] * np.exp(w) / grid_w  # unit: image width
-                    h = anchors[2 * b + 1] * np.exp(h) / grid_h  # unit: image height
-                    confidence = netout[row, col, b, 4]
+    boxes = np.stack([x - w / 2, y - h / 2, x + w / 2, y + h / 2], axis=-1)
 
-                    box = BoundBox(x - w / 2, y - h / 2, x + w / 2, y + h / 2, confidence, classes)
+    return boxes, confidence, classes
 
-                    boxes.append(box)
 
+def _suppress_boxes(boxes, classes, obj_threshold, nms_threshold):
+    """
+    Zero the class scores of the non-maximal boxes of each class, classes is modified in place.
+    :return: mask of the boxes with a class score left above obj_threshold
+    """
     # suppress non-maximal boxes
-    for c in range(nb_class):
-        sorted_indices = list(reversed(np.argsort([box.classes[c] for box in boxes])))
+    for c in range(classes.shape[1]):
+        candidates = np.nonzero(classes[:, c])[0]
+        keep = non_max_suppression(boxes[candidates], classes[candidates, c], nms_threshold)
 
-        for i in range(len(sorted_indices)):
-            index_i = sorted_indices[i]
+        suppressed = np.ones(candidates.shape[0], dtype=bool)
+        suppressed[keep] = False
+        classes[candidates[suppressed], c] = 0
 
-            if boxes[index_i].classes[c] == 0:
-                continue
-            else:
-                for j in range(i + 1, len(sorted_indices)):
-                    index_j = sorted_indices[j]
+    # remove the boxes which are less likely than a obj_threshold
+    return np.max(classes, axis=-1) > obj_threshold
 
-                    if bbox_iou(boxes[index_i], boxes[index_j]) >= nms_threshold:
-                        boxes[index_i].classes[c] = 0
 
-    # remove the boxes which are less likely than a obj_threshold
-    boxes = [box for box in boxes if box.get_score() > obj_threshold]
+def non_max_suppression(boxes, scores, iou_threshold=0.3, labels=None):
+    """
+    Greedy non-maximum suppression over arrays of boxes.
+    :param boxes: (N, 4) ndarray of [xmin, ymin, xmax, ymax]
+    :param scores: (N,) ndarray of scores
+    :param iou_threshold: a box is suppressed when its IoU with a better scored box is >= iou_threshold
+    :param labels: (N,) ndarray of labels to suppress boxes only against boxes of the same class, if None the
+                   suppression is class agnostic
+    :return: ndarray with the indices of the kept boxes, sorted by decreasing score
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    scores = np.asarray(scores)
+
+    if boxes.shape[0] == 0:
+        return np.zeros((0,), dtype=int)
 
-    return boxes
+    if labels is not None:
+        # move each class to its own region, so boxes from different classes never overlap
+        offset = np.max(boxes) - np.min(boxes) + 1
+        boxes = boxes + offset * np.asarray(labels, dtype=np.float64)[:, np.newaxis]
+
+    order = np.argsort(-scores, kind='mergesort')
+    keep = []
+
+    while order.shape[0] > 0:
+        best = order[0]
+        keep.append(best)
+
+        overlaps = compute_overlap(boxes[best][np.newaxis], boxes[order[1:]])[0]
+        order = order[1:][overlaps < iou_threshold]
+
+    return np.array(keep, dtype=int)
 
 
 def compute_overlap(a, b):
@@ -249,28 +444,28 @@ def import_dynamically(name):
     return mod
 
 
+_FEATURE_EXTRACTORS = {'Inception3': 'Inception3Feature',
+                        'SqueezeNet': 'SqueezeNetFeature',
+                        'MobileNet': 'MobileNetFeature',
+                        'Full Yolo': 'FullYoloFeature',
+                        'Tiny Yolo': 'TinyYoloFeature',
+                        'VGG16': 'VGG16Feature',
+                        'ResNet50': 'ResNet50Feature'}
+
+
 def import_feature_extractor(backend, input_size):
-    if backend == 'Inception3':
-        feature_extractor = Inception3Feature(input_size)
-    elif backend == 'SqueezeNet':
-        feature_extractor = SqueezeNetFeature(input_size)
-    elif backend == 'MobileNet':
-        feature_extractor = MobileNetFeature(input_size)
-    elif backend == 'Full Yolo':
-        feature_extractor = FullYoloFeature(input_size)
-    elif backend == 'Tiny Yolo':
-        feature_extractor = TinyYoloFeature(input_size)
-    elif backend == 'VGG16':
-        feature_extractor = VGG16Feature(input_size)
-    elif backend == 'ResNet50':
-        feature_extractor = ResNet50Feature(input_size)
+    # keras is only imported when a feature extractor is built, so the inference-only modules start faster
+    from . import backend as backends
+
+    if backend in _FEATURE_EXTRACTORS:
+        feature_extractor = getattr(backends, _FEATURE_EXTRACTORS[backend])(input_size)
     elif os.path.dirname(backend) != "":
         base_path = os.path.dirname(backend)
         sys.path.append(base_path)
         custom_backend_name = os.path.basename(backend)
         custom_backend = import_dynamically(custom_backend_name)
         feature_extractor = custom_backend(input_size)
-        if not issubclass(custom_backend, BaseFeatureExtractor):
+        if not issubclass(custom_backend, backends.BaseFeatureExtractor):
             raise RuntimeError('You are trying to import a custom backend, your backend must be in inherited from '
                                ' "backend.BaseFeatureExtractor".')
         print('Using a custom backend called {}.'.format(custom_backend_name))
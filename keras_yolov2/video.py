@@ -0,0 +1,332 @@
+from .utils import draw_boxes
+from threading import Thread, Event, Condition
+from queue import Queue, Empty
+import numpy as np
+import time
+import cv2
+
+
+class _Stage(object):
+    """
+    Keeps the number of processed frames and the time spent working by one stage of the pipeline.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.busy_time = 0.
+
+    def add(self, frames, start):
+        self.frames += frames
+        self.busy_time += time.time() - start
+
+    def fps(self):
+        return self.frames / max(self.busy_time, np.finfo(float).eps)
+
+
+class VideoPipeline(object):
+    """
+    Process a video file in three stages running at the same time: a reader thread decoding frames, the inference
+    stage predicting batches of frames in the calling thread and a writer thread drawing and encoding the results.
+    The stages are connected by bounded queues and the frames are written in the same order they were read.
+
+    # Arguments
+        yolo            : YOLO object used to predict the frames.
+        labels          : list of labels used to draw the boxes.
+        batch_size      : number of frames predicted at once.
+        queue_size      : maximum number of frames waiting between two stages.
+        iou_threshold   : IoU threshold of the non max suppression.
+        score_threshold : minimum score to keep a box.
+        input_size      : optional (height, width) of the network input, only for models built with flexible_input.
+    """
+
+    def __init__(self, yolo, labels, batch_size=8, queue_size=32, iou_threshold=0.5, score_threshold=0.5,
+                 input_size=None):
+        self._yolo = yolo
+        self._labels = labels
+        self._batch_size = batch_size
+        self._queue_size = queue_size
+        self._iou_threshold = iou_threshold
+        self._score_threshold = score_threshold
+        self._input_size = input_size
+
+        self.stages = []
+
+    def run(self, video_in, video_out, fps=50.0, callback=None):
+        """
+        :param video_in: path of the input video
+        :param video_out: path of the output video, XVID encoded
+        :param fps: frame rate of the output video
+        :param callback: optional function called with the number of frames written so far, e.g. to update a
+                         progress bar
+        :return: dict with the frames per second of each stage and of the whole pipeline
+        """
+        video_reader = cv2.VideoCapture(video_in)
+        frame_h = int(video_reader.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        frame_w = int(video_reader.get(cv2.CAP_PROP_FRAME_WIDTH))
+        video_writer = cv2.VideoWriter(video_out, cv2.VideoWriter_fourcc(*'XVID'), fps, (frame_w, frame_h))
+
+        read_stage = _Stage('read')
+        inference_stage = _Stage('inference')
+        write_stage = _Stage('write')
+        self.stages = [read_stage, inference_stage, write_stage]
+
+        read_queue = Queue(maxsize=self._queue_size)
+        write_queue = Queue(maxsize=self._queue_size)
+        errors = []
+        stop = Event()
+
+        def read():
+            try:
+                while not stop.is_set():
+                    start = time.time()
+                    ret, frame = video_reader.read()
+                    if not ret:
+                        break
+                    read_stage.add(1, start)
+                    read_queue.put(frame)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                read_queue.put(None)
+
+        def write():
+            try:
+                while True:
+                    item = write_queue.get()
+                    if item is None:
+                        break
+                    start = time.time()
+                    frame, boxes = item
+                    frame = draw_boxes(frame, boxes, self._labels)
+                    video_writer.write(np.uint8(frame))
+                    write_stage.add(1, start)
+
+                    if callback is not None:
+                        callback(write_stage.frames)
+            except Exception as e:
+                errors.append(e)
+                # keep draining the queue, so the inference stage is never blocked
+                while write_queue.get() is not None:
+                    pass
+
+        reader = Thread(target=read, daemon=True)
+        writer = Thread(target=write, daemon=True)
+        reader.start()
+        writer.start()
+
+        start_time = time.time()
+        finished = False
+        try:
+            while not finished:
+                frames = [read_queue.get()]
+                while frames[-1] is not None and len(frames) < self._batch_size:
+                    frames.append(read_queue.get())
+                if frames[-1] is None:
+                    frames.pop()
+                    finished = True
+                if len(frames) == 0:
+                    break
+
+                start = time.time()
+                all_boxes = self._yolo.predict_batch(frames,
+                                                     batch_size=self._batch_size,
+                                                     iou_threshold=self._iou_threshold,
+                                                     score_threshold=self._score_threshold,
+                                                     as_detections=True,
+                                                     input_size=self._input_size)
+                inference_stage.add(len(frames), start)
+
+                for frame, boxes in zip(frames, all_boxes):
+                    write_queue.put((frame, boxes))
+        finally:
+            write_queue.put(None)
+            writer.join()
+
+            # unblock the reader in case the inference stage stopped before the end of the video
+            stop.set()
+            while reader.is_alive():
+                try:
+                    read_queue.get(timeout=0.1)
+                except Empty:
+                    pass
+            video_reader.release()
+            video_writer.release()
+
+        if len(errors) > 0:
+            raise errors[0]
+
+        total_time = time.time() - start_time
+        stats = {stage.name: stage.fps() for stage in self.stages}
+        stats['pipeline'] = write_stage.frames / max(total_time, np.finfo(float).eps)
+
+        return stats
+
+
+class LatestFrameReader(object):
+    """
+    Capture thread that keeps only the newest frame of a source, the older frames not read in time are dropped, so
+    a slow consumer always gets the freshest frame instead of the oldest one buffered by OpenCV.
+
+    # Arguments
+        source   : camera index or path of a video file.
+        realtime : if True, the frames are read at the native frame rate of the source, so a video file can stand in
+                   for a camera. By default it is True for files and False for cameras.
+    """
+
+    def __init__(self, source, realtime=None):
+        self._capture = cv2.VideoCapture(source)
+        if not self._capture.isOpened():
+            raise ValueError("Unable to open the video source {}.".format(source))
+
+        if realtime is None:
+            realtime = not isinstance(source, int)
+        fps = self._capture.get(cv2.CAP_PROP_FPS)
+        self._frame_interval = 1. / fps if realtime and fps > 0 else 0.
+
+        self._condition = Condition()
+        self._frame = None
+        self._timestamp = None
+        self._frame_id = 0
+        self._last_read_id = 0
+        self._finished = False
+        self._thread = None
+
+        self.dropped_frames = 0
+
+    def start(self):
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        next_time = time.time()
+        while not self._finished:
+            ret, frame = self._capture.read()
+            timestamp = time.time()
+
+            with self._condition:
+                if not ret:
+                    self._finished = True
+                else:
+                    if self._frame_id > self._last_read_id:
+                        self.dropped_frames += 1
+                    self._frame = frame
+                    self._timestamp = timestamp
+                    self._frame_id += 1
+                self._condition.notify_all()
+
+            if self._frame_interval > 0:
+                next_time += self._frame_interval
+                time.sleep(max(next_time - time.time(), 0))
+
+        self._capture.release()
+
+    def read(self, timeout=None):
+        """
+        Wait for a frame newer than the last one returned.
+        :return: tuple with the frame and the time it was captured, or (None, None) when the source has ended
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._frame_id > self._last_read_id or self._finished, timeout)
+            if self._frame_id == self._last_read_id:
+                return None, None
+
+            self._last_read_id = self._frame_id
+            return self._frame, self._timestamp
+
+    @property
+    def finished(self):
+        """
+        True when the source has ended and its last frame was already read.
+        """
+        with self._condition:
+            return self._finished and self._frame_id == self._last_read_id
+
+    def stop(self):
+        with self._condition:
+            self._finished = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        else:
+            self._capture.release()
+
+
+class MultiStreamRunner(object):
+    """
+    Serve many video sources with a single YOLO model. At each tick the newest frame of every source is collected
+    into one batch, predicted with one forward pass, and the detections are sent to the sink of each source.
+
+    # Arguments
+        yolo            : YOLO object used to predict the frames.
+        sources         : list of camera indexes or video file paths.
+        sinks           : list with one function per source, called as sink(frame, detections).
+        realtime        : passed to the LatestFrameReader of each source.
+        iou_threshold   : IoU threshold of the non max suppression.
+        score_threshold : minimum score to keep a box.
+        poll_interval   : seconds to wait when no source has a new frame.
+    """
+
+    def __init__(self, yolo, sources, sinks, realtime=None, iou_threshold=0.5, score_threshold=0.5,
+                 poll_interval=0.001):
+        if len(sources) != len(sinks):
+            raise ValueError("Each source must have exactly one sink.")
+
+        self._yolo = yolo
+        self._sources = sources
+        self._sinks = sinks
+        self._realtime = realtime
+        self._iou_threshold = iou_threshold
+        self._score_threshold = score_threshold
+        self._poll_interval = poll_interval
+
+    def run(self, max_ticks=None):
+        """
+        :param max_ticks: stop after this number of forward passes, by default it runs until every source has ended
+        :return: dict with the number of ticks, the frames predicted per stream, the mean batch size and the frames
+                 per second of the whole runner
+        """
+        readers = [LatestFrameReader(source, self._realtime).start() for source in self._sources]
+        frames_per_stream = [0] * len(readers)
+        ticks = 0
+
+        start_time = time.time()
+        try:
+            while max_ticks is None or ticks < max_ticks:
+                stream_ids = []
+                frames = []
+                for i, reader in enumerate(readers):
+                    frame, _ = reader.read(timeout=0)
+                    if frame is not None:
+                        stream_ids.append(i)
+                        frames.append(frame)
+
+                if len(frames) == 0:
+                    if all(reader.finished for reader in readers):
+                        break
+                    time.sleep(self._poll_interval)
+                    continue
+
+                all_boxes = self._yolo.predict_batch(frames,
+                                                     batch_size=len(frames),
+                                                     iou_threshold=self._iou_threshold,
+                                                     score_threshold=self._score_threshold,
+                                                     as_detections=True)
+                ticks += 1
+
+                for i, frame, boxes in zip(stream_ids, frames, all_boxes):
+                    frames_per_stream[i] += 1
+                    self._sinks[i](frame, boxes)
+        finally:
+            for reader in readers:
+                reader.stop()
+
+        total_time = time.time() - start_time
+        total_frames = sum(frames_per_stream)
+
+        return {'ticks': ticks,
+                'frames_per_stream': frames_per_stream,
+                'dropped_frames_per_stream': [reader.dropped_frames for reader in readers],
+                'mean_batch_size': total_frames / max(ticks, 1),
+                'fps': total_frames / max(total_time, np.finfo(float).eps)}
@@ -0,0 +1,192 @@
+from .utils import get_session, Detections
+from .frontend import YOLO
+from multiprocessing import shared_memory
+import multiprocessing
+import numpy as np
+import traceback
+import queue
+import keras
+import cv2
+
+
+class ProcessPoolPredictor(object):
+    """
+    Predict images with a pool of worker processes, each one with its own copy of the model, so the pre and post
+    processing of different images run on different cores. The frames are copied into a shared memory ring buffer
+    instead of being pickled, and the results are yielded in the same order as the input images.
+
+    # Arguments
+        config          : configuration dict, the model section is used to build the YOLO of each worker.
+        weights_path    : path of the weights loaded by each worker.
+        nb_workers      : number of worker processes.
+        batch_size      : maximum number of images predicted at once by a worker.
+        max_frame_shape : (height, width, channels) of the largest frame, bigger frames are shrunk to fit into a slot
+                          of the ring buffer, this does not change the boxes because they are relative to the image.
+        nb_slots        : number of frames in the ring buffer, by default 2 * nb_workers * batch_size.
+        iou_threshold   : IoU threshold of the non max suppression.
+        score_threshold : minimum score to keep a box.
+        input_size      : optional (height, width) of the network input, the workers then build their model with
+                          flexible_input.
+    """
+
+    def __init__(self, config, weights_path, nb_workers=2, batch_size=4, max_frame_shape=(1080, 1920, 3),
+                 nb_slots=None, iou_threshold=0.5, score_threshold=0.5, input_size=None):
+        self._max_frame_shape = tuple(max_frame_shape)
+        self._slot_size = int(np.prod(self._max_frame_shape))
+        self._nb_slots = nb_slots if nb_slots is not None else 2 * nb_workers * batch_size
+
+        self._shared_memory = shared_memory.SharedMemory(create=True, size=self._nb_slots * self._slot_size)
+        self._slots = np.ndarray((self._nb_slots, self._slot_size), dtype=np.uint8, buffer=self._shared_memory.buf)
+
+        # spawn, so the workers never inherit the tensorflow state of this process
+        context = multiprocessing.get_context('spawn')
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._workers = [context.Process(target=_worker,
+                                         args=(config, weights_path, self._shared_memory.name, self._nb_slots,
+                                               self._slot_size, self._tasks, self._results, batch_size,
+                                               iou_threshold, score_threshold, input_size),
+                                         daemon=True)
+                         for _ in range(nb_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def predict(self, images):
+        """
+        :param images: iterable of uint8 images, they can have different sizes
+        :return: generator of (image, Detections) tuples, in the same order as images
+        """
+        free_slots = list(range(self._nb_slots))
+        pending_images = {}
+        done = {}
+        next_seq = 0
+        next_out = 0
+        images = iter(images)
+        exhausted = False
+
+        while not exhausted or next_out < next_seq:
+            # keep at most nb_slots images between the oldest one not yielded yet and the newest one sent
+            while not exhausted and len(free_slots) > 0 and next_seq - next_out < self._nb_slots:
+                try:
+                    image = next(images)
+                except StopIteration:
+                    exhausted = True
+                    break
+
+                slot = free_slots.pop()
+                shape = self._write_slot(slot, image)
+                pending_images[next_seq] = image
+                self._tasks.put((next_seq, slot, shape))
+                next_seq += 1
+
+            if next_out == next_seq:
+                continue
+
+            result = self._get_result()
+            seq, slot, boxes, scores, labels = result
+            free_slots.append(slot)
+            done[seq] = Detections(boxes, scores, labels)
+
+            while next_out in done:
+                yield pending_images.pop(next_out), done.pop(next_out)
+                next_out += 1
+
+    def _write_slot(self, slot, image):
+        if image.dtype != np.uint8:
+            raise ValueError("Only uint8 images can be sent to the workers.")
+
+        max_h, max_w = self._max_frame_shape[:2]
+        if image.shape[0] > max_h or image.shape[1] > max_w or image.size > self._slot_size:
+            scale = min(float(max_h) / image.shape[0], float(max_w) / image.shape[1])
+            new_size = (max(int(image.shape[1] * scale), 1), max(int(image.shape[0] * scale), 1))
+            image = cv2.resize(image, new_size, interpolation=cv2.INTER_AREA)
+
+        self._slots[slot, :image.size] = image.reshape(-1)
+        return image.shape
+
+    def _get_result(self):
+        while True:
+            try:
+                result = self._results.get(timeout=1.)
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self._workers):
+                    raise RuntimeError("A worker process died unexpectedly.")
+                continue
+
+            if result[0] is None:
+                raise RuntimeError("A worker process failed:\n{}".format(result[1]))
+            return result
+
+    def close(self):
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+
+        del self._slots
+        self._shared_memory.close()
+        self._shared_memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+def _worker(config, weights_path, shared_memory_name, nb_slots, slot_size, tasks, results, batch_size,
+            iou_threshold, score_threshold, input_size):
+    frames_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    slots = np.ndarray((nb_slots, slot_size), dtype=np.uint8, buffer=frames_memory.buf)
+
+    try:
+        keras.backend.tensorflow_backend.set_session(get_session())
+
+        yolo = YOLO(backend=config['model']['backend'],
+                    input_size=(config['model']['input_size_h'], config['model']['input_size_w']),
+                    labels=config['model']['labels'],
+                    anchors=config['model']['anchors'],
+                    gray_mode=config['model']['gray_mode'],
+                    flexible_input=input_size is not None,
+                    verbose=False)
+        yolo.load_weights(weights_path)
+
+        finished = False
+        while not finished:
+            task = tasks.get()
+            if task is None:
+                break
+
+            batch = [task]
+            while len(batch) < batch_size:
+                try:
+                    task = tasks.get_nowait()
+                except queue.Empty:
+                    break
+                if task is None:
+                    finished = True
+                    break
+                batch.append(task)
+
+            _predict_slots(yolo, slots, batch, results, iou_threshold, score_threshold, input_size)
+    except Exception:
+        results.put((None, traceback.format_exc()))
+    finally:
+        del slots
+        frames_memory.close()
+
+
+def _predict_slots(yolo, slots, batch, results, iou_threshold, score_threshold, input_size):
+    # the views into the shared memory only live inside this function, so the memory can be closed later
+    images = [slots[slot, :int(np.prod(shape))].reshape(shape) for _, slot, shape in batch]
+    all_boxes = yolo.predict_batch(images,
+                                   batch_size=len(images),
+                                   iou_threshold=iou_threshold,
+                                   score_threshold=score_threshold,
+                                   as_detections=True,
+                                   input_size=input_size)
+
+    for (seq, slot, _), boxes in zip(batch, all_boxes):
+        results.put((seq, slot, boxes.boxes, boxes.scores, boxes.labels))
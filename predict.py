@@ -2,11 +2,14 @@
 from keras_yolov2.utils import draw_boxes, get_session
 from keras_yolov2.frontend import YOLO
 from keras_yolov2.utils import list_images
+from keras_yolov2.video import VideoPipeline, LatestFrameReader
+from keras_yolov2.workers import ProcessPoolPredictor
 from tqdm import tqdm
 import numpy as np
 import argparse
 import keras
 import json
+import time
 import cv2
 import os
 
@@ -33,13 +36,54 @@ argparser.add_argument(
     '--real_time',
     default=False,
     type=bool,
-    help='use a camera for real time prediction')
+    help='use a camera for real time prediction, the input is the camera index or a video file played at its '
+         'native frame rate')
 
 argparser.add_argument(
     '-i',
     '--input',
     help='path to an image or an video (mp4 format)')
 
+argparser.add_argument(
+    '-b',
+    '--batch_size',
+    default=8,
+    type=int,
+    help='number of images predicted at once in directory and pipeline modes')
+
+argparser.add_argument(
+    '-n',
+    '--workers',
+    default=0,
+    type=int,
+    help='number of worker processes, each one with its own model, used for videos and directories')
+
+argparser.add_argument(
+    '-s',
+    '--input_size',
+    default='',
+    help='input size used for the prediction, as HEIGHTxWIDTH or a single value for square inputs, the model is '
+         'then built with a flexible input so the same weights can be used at any resolution')
+
+argparser.add_argument(
+    '-t',
+    '--tile_size',
+    default=0,
+    type=int,
+    help='split images into overlapping square tiles of this size in pixels, 0 to disable')
+
+argparser.add_argument(
+    '--tile_overlap',
+    default=0.2,
+    type=float,
+    help='fraction of each tile shared with its neighbours')
+
+argparser.add_argument(
+    '-p',
+    '--pipeline',
+    action='store_true',
+    help='read, predict and write the video frames in parallel stages')
+
 
 def _main_(args):
     config_path = args.conf
@@ -56,6 +100,18 @@ def _main_(args):
     if weights_path == '':
         weights_path = config['train']['pretrained_weights"']
 
+    input_size = None
+    if args.input_size != '':
+        input_size = tuple(int(size) for size in args.input_size.split('x'))
+        if len(input_size) == 1:
+            input_size = input_size * 2
+
+    # a single image is predicted in this process, the workers only pay off on videos and folders
+    single_image = os.path.isfile(image_path) and os.path.splitext(image_path)[1] not in videos_format
+    if args.workers > 0 and not use_camera and not single_image:
+        _predict_with_workers(args, config, weights_path, videos_format, input_size)
+        return
+
     ###################
     #   Make the model 
     ###################
@@ -64,7 +120,8 @@ def _main_(args):
                 input_size=(config['model']['input_size_h'], config['model']['input_size_w']),
                 labels=config['model']['labels'],
                 anchors=config['model']['anchors'],
-                gray_mode=config['model']['gray_mode'])
+                gray_mode=config['model']['gray_mode'],
+                flexible_input=input_size is not None)
 
     #########################
     #   Load trained weights
@@ -77,20 +134,52 @@ def _main_(args):
     ###########################
 
     if use_camera:
-        video_reader = cv2.VideoCapture(int(image_path))
+        # a video file can stand in for the camera, it is played at its native frame rate
+        source = int(image_path) if image_path.isdigit() else image_path
+        frame_reader = LatestFrameReader(source).start()
+        latencies = []
         pbar = tqdm()
         while True:
-            pbar.update(1)
-            ret, frame = video_reader.read()
-            if not ret:
+            frame, capture_time = frame_reader.read()
+            if frame is None:
                 break
-            boxes = yolo.predict(frame)
+            pbar.update(1)
+            boxes = yolo.predict(frame, as_detections=True, input_size=input_size)
             frame = draw_boxes(frame, boxes, config['model']['labels'])
+
+            latencies.append(time.time() - capture_time)
+            cv2.putText(frame, "latency: {:.1f} ms".format(latencies[-1] * 1000), (10, 30),
+                        cv2.FONT_HERSHEY_PLAIN, 1.5, (0, 0, 255), 2)
             cv2.imshow("frame", frame)
             key = cv2.waitKey(1)
             if key == ord("q") or key == 27:
                 break
+        frame_reader.stop()
         pbar.close()
+
+        if len(latencies) > 0:
+            print('mean latency: {:.1f} ms, dropped frames: {}'.format(np.mean(latencies) * 1000,
+                                                                        frame_reader.dropped_frames))
+    elif os.path.splitext(image_path)[1] in videos_format and args.pipeline:
+        file, ext = os.path.splitext(image_path)
+        video_out = '{}_detected.avi'.format(file)
+        print(video_out)
+
+        video_reader = cv2.VideoCapture(image_path)
+        nb_frames = int(video_reader.get(cv2.CAP_PROP_FRAME_COUNT))
+        video_reader.release()
+
+        pipeline = VideoPipeline(yolo, config['model']['labels'],
+                                 batch_size=args.batch_size,
+                                 iou_threshold=config['valid']['iou_threshold'],
+                                 score_threshold=config['valid']['score_threshold'],
+                                 input_size=input_size)
+        pbar = tqdm(total=nb_frames)
+        stats = pipeline.run(image_path, video_out, fps=50.0, callback=lambda n: pbar.update(n - pbar.n))
+        pbar.close()
+
+        for stage, fps in stats.items():
+            print('{}: {:.2f} fps'.format(stage, fps))
     elif os.path.splitext(image_path)[1] in videos_format:
         file, ext = os.path.splitext(image_path)
         video_out = '{}_detected.avi'.format(file)
@@ -109,7 +198,9 @@ def _main_(args):
             _, image = video_reader.read()
             boxes = yolo.predict(image,
                                  iou_threshold=config['valid']['iou_threshold'],
-                                 score_threshold=config['valid']['score_threshold'])
+                                 score_threshold=config['valid']['score_threshold'],
+                                 as_detections=True,
+                                 input_size=input_size)
 
             image = draw_boxes(image, boxes, config['model']['labels'])
             video_writer.write(np.uint8(image))
@@ -119,9 +210,20 @@ def _main_(args):
     else:
         if os.path.isfile(image_path):
             image = cv2.imread(image_path)
-            boxes = yolo.predict(image,
-                                 iou_threshold=config['valid']['iou_threshold'],
-                                 score_threshold=config['valid']['score_threshold'])
+            if args.tile_size > 0:
+                boxes = yolo.predict_tiled(image,
+                                           tile_size=(args.tile_size, args.tile_size),
+                                           overlap=args.tile_overlap,
+                                           batch_size=args.batch_size,
+                                           iou_threshold=config['valid']['iou_threshold'],
+                                           score_threshold=config['valid']['score_threshold'],
+                                           input_size=input_size)
+            else:
+                boxes = yolo.predict(image,
+                                     iou_threshold=config['valid']['iou_threshold'],
+                                     score_threshold=config['valid']['score_threshold'],
+                                     as_detections=True,
+                                     input_size=input_size)
             image = draw_boxes(image, boxes, config['model']['labels'])
 
             print(len(boxes), 'boxes are found')
@@ -131,12 +233,83 @@ def _main_(args):
             if not os.path.exists(detected_images_path):
                 os.mkdir(detected_images_path)
             images = list(list_images(image_path))
-            for fname in tqdm(images):
-                image = cv2.imread(fname)
-                boxes = yolo.predict(image)
-                image = draw_boxes(image, boxes, config['model']['labels'])
+            if args.tile_size > 0:
+                for fname in tqdm(images):
+                    image = cv2.imread(fname)
+                    boxes = yolo.predict_tiled(image,
+                                               tile_size=(args.tile_size, args.tile_size),
+                                               overlap=args.tile_overlap,
+                                               batch_size=args.batch_size,
+                                               iou_threshold=config['valid']['iou_threshold'],
+                                               score_threshold=config['valid']['score_threshold'],
+                                               input_size=input_size)
+                    image = draw_boxes(image, boxes, config['model']['labels'])
+                    fname = os.path.basename(fname)
+                    cv2.imwrite(os.path.join(image_path, "detected", fname), image)
+                return
+            for l_bound in tqdm(range(0, len(images), args.batch_size)):
+                fnames = images[l_bound:l_bound + args.batch_size]
+                batch = [cv2.imread(fname) for fname in fnames]
+                all_boxes = yolo.predict_batch(batch, batch_size=args.batch_size, as_detections=True,
+                                               input_size=input_size)
+                for fname, image, boxes in zip(fnames, batch, all_boxes):
+                    image = draw_boxes(image, boxes, config['model']['labels'])
+                    fname = os.path.basename(fname)
+                    cv2.imwrite(os.path.join(image_path, "detected", fname), image)
+
+
+def _predict_with_workers(args, config, weights_path, videos_format, input_size):
+    image_path = args.input
+    labels = config['model']['labels']
+
+    if os.path.splitext(image_path)[1] in videos_format:
+        video_reader = cv2.VideoCapture(image_path)
+        nb_frames = int(video_reader.get(cv2.CAP_PROP_FRAME_COUNT))
+        frame_h = int(video_reader.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        frame_w = int(video_reader.get(cv2.CAP_PROP_FRAME_WIDTH))
+
+        file, ext = os.path.splitext(image_path)
+        video_out = '{}_detected.avi'.format(file)
+        print(video_out)
+        video_writer = cv2.VideoWriter(video_out, cv2.VideoWriter_fourcc(*'XVID'), 50.0, (frame_w, frame_h))
+
+        def read_frames():
+            while True:
+                ret, frame = video_reader.read()
+                if not ret:
+                    break
+                yield frame
+
+        with ProcessPoolPredictor(config, weights_path,
+                                  nb_workers=args.workers,
+                                  batch_size=args.batch_size,
+                                  max_frame_shape=(frame_h, frame_w, 3),
+                                  iou_threshold=config['valid']['iou_threshold'],
+                                  score_threshold=config['valid']['score_threshold'],
+                                  input_size=input_size) as predictor:
+            for image, boxes in tqdm(predictor.predict(read_frames()), total=nb_frames):
+                image = draw_boxes(image, boxes, labels)
+                video_writer.write(np.uint8(image))
+
+        video_reader.release()
+        video_writer.release()
+    else:
+        detected_images_path = os.path.join(image_path, "detected")
+        if not os.path.exists(detected_images_path):
+            os.mkdir(detected_images_path)
+        images = list(list_images(image_path))
+
+        with ProcessPoolPredictor(config, weights_path,
+                                  nb_workers=args.workers,
+                                  batch_size=args.batch_size,
+                                  iou_threshold=config['valid']['iou_threshold'],
+                                  score_threshold=config['valid']['score_threshold'],
+                                  input_size=input_size) as predictor:
+            all_results = predictor.predict(cv2.imread(fname) for fname in images)
+            for fname, (image, boxes) in tqdm(zip(images, all_results), total=len(images)):
+                image = draw_boxes(image, boxes, labels)
                 fname = os.path.basename(fname)
-                cv2.imwrite(os.path.join(image_path, "detected", fname), image)
+                cv2.imwrite(os.path.join(detected_images_path, fname), image)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+from keras_yolov2.utils import draw_boxes, get_session
+from keras_yolov2.frontend import YOLO
+from keras_yolov2.video import MultiStreamRunner
+import numpy as np
+import argparse
+import keras
+import json
+import cv2
+import os
+
+argparser = argparse.ArgumentParser(
+    description='Predict many video streams with a single YOLO_v2 model')
+
+argparser.add_argument(
+    '-c',
+    '--conf',
+    default='config.json',
+    help='path to configuration file')
+
+argparser.add_argument(
+    '-w',
+    '--weights',
+    default='',
+    help='path to pretrained weights')
+
+argparser.add_argument(
+    '-i',
+    '--input',
+    nargs='+',
+    help='camera indexes or paths of video files, the files are played at their native frame rate')
+
+
+class VideoSink(object):
+    """
+    Draw the detections and write the frames of one stream into {name}_detected.avi.
+    """
+
+    def __init__(self, source, labels):
+        name = 'camera_{}'.format(source) if source.isdigit() else os.path.splitext(source)[0]
+        self._video_out = '{}_detected.avi'.format(name)
+        self._labels = labels
+        self._video_writer = None
+
+    def __call__(self, frame, boxes):
+        if self._video_writer is None:
+            frame_h, frame_w = frame.shape[:2]
+            self._video_writer = cv2.VideoWriter(self._video_out,
+                                                 cv2.VideoWriter_fourcc(*'XVID'),
+                                                 25.0,
+                                                 (frame_w, frame_h))
+        frame = draw_boxes(frame, boxes, self._labels)
+        self._video_writer.write(np.uint8(frame))
+
+    def release(self):
+        if self._video_writer is not None:
+            self._video_writer.release()
+
+
+def _main_(args):
+    config_path = args.conf
+    weights_path = args.weights
+
+    keras.backend.tensorflow_backend.set_session(get_session())
+
+    with open(config_path) as config_buffer:
+        config = json.load(config_buffer)
+
+    if weights_path == '':
+        weights_path = config['train']['saved_weights_name']
+
+    yolo = YOLO(backend=config['model']['backend'],
+                input_size=(config['model']['input_size_h'], config['model']['input_size_w']),
+                labels=config['model']['labels'],
+                anchors=config['model']['anchors'],
+                gray_mode=config['model']['gray_mode'])
+
+    yolo.load_weights(weights_path)
+
+    sources = [int(source) if source.isdigit() else source for source in args.input]
+    sinks = [VideoSink(source, config['model']['labels']) for source in args.input]
+
+    runner = MultiStreamRunner(yolo, sources, sinks,
+                               iou_threshold=config['valid']['iou_threshold'],
+                               score_threshold=config['valid']['score_threshold'])
+    try:
+        stats = runner.run()
+    finally:
+        for sink in sinks:
+            sink.release()
+
+    print('ticks: {}, mean batch size: {:.2f}, {:.2f} fps'.format(stats['ticks'], stats['mean_batch_size'],
+                                                                 stats['fps']))
+    for source, frames, dropped in zip(args.input, stats['frames_per_stream'], stats['dropped_frames_per_stream']):
+        print('{}: {} frames predicted, {} dropped'.format(source, frames, dropped))
+
+
+if __name__ == '__main__':
+    _args = argparser.parse_args()
+    _main_(_args)
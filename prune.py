@@ -0,0 +1,180 @@
+#! /usr/bin/env python3
+from keras_yolov2.preprocessing import parse_annotation_xml, parse_annotation_csv
+from keras_yolov2.preprocessing import BatchGenerator
+from keras_yolov2.pruning import count_flops, measure_latency
+from keras_yolov2.map_evaluation import MapEvaluation
+from keras_yolov2.utils import get_session
+from keras_yolov2.frontend import YOLO
+import numpy as np
+import argparse
+import keras
+import json
+import os
+
+argparser = argparse.ArgumentParser(
+    description='Prune the filters of the conv_i layers of a YOLO_v2 model and fine-tune it')
+
+argparser.add_argument(
+    '-c',
+    '--conf',
+    default='config.json',
+    help='path to configuration file')
+
+argparser.add_argument(
+    '-w',
+    '--weights',
+    default='',
+    help='path to pretrained weights')
+
+argparser.add_argument(
+    '-r',
+    '--ratio',
+    default=0.3,
+    type=float,
+    help='fraction of the filters removed from each prunable convolution')
+
+argparser.add_argument(
+    '-e',
+    '--epochs',
+    default=10,
+    type=int,
+    help='number of fine-tuning epochs after the pruning, 0 to skip the fine-tuning')
+
+
+def report(yolo, generator, iou_threshold, score_threshold):
+    model = yolo.get_inference_model()
+    _map, _ = MapEvaluation(yolo, generator,
+                            iou_threshold=iou_threshold,
+                            score_threshold=score_threshold).evaluate_map()
+
+    return {'flops': count_flops(model),
+            'params': model.count_params(),
+            'latency': measure_latency(model),
+            'mAP': _map}
+
+
+def _main_(args):
+    config_path = args.conf
+    weights_path = args.weights
+
+    keras.backend.tensorflow_backend.set_session(get_session())
+
+    with open(config_path) as config_buffer:
+        config = json.load(config_buffer)
+
+    if weights_path == '':
+        weights_path = config['train']['saved_weights_name']
+
+    ##########################
+    #   Parse the annotations
+    ##########################
+    valid_imgs = None
+    if config['parser_annotation_type'] == 'xml':
+        train_imgs, _ = parse_annotation_xml(config['train']['train_annot_folder'],
+                                             config['train']['train_image_folder'],
+                                             config['model']['labels'],
+                                             cache_dir=config.get('annotation_cache_dir', ''))
+        if os.path.exists(config['valid']['valid_annot_folder']):
+            valid_imgs, _ = parse_annotation_xml(config['valid']['valid_annot_folder'],
+                                                 config['valid']['valid_image_folder'],
+                                                 config['model']['labels'],
+                                                 cache_dir=config.get('annotation_cache_dir', ''))
+    elif config['parser_annotation_type'] == 'csv':
+        train_imgs, _ = parse_annotation_csv(config['train']['train_csv_file'],
+                                             config['model']['labels'],
+                                             config['train']['train_csv_base_path'],
+                                             cache_dir=config.get('annotation_cache_dir', ''))
+        if os.path.exists(config['valid']['valid_csv_file']):
+            valid_imgs, _ = parse_annotation_csv(config['valid']['valid_csv_file'],
+                                                 config['model']['labels'],
+                                                 config['valid']['valid_csv_base_path'],
+                                                 cache_dir=config.get('annotation_cache_dir', ''))
+    else:
+        raise ValueError("'parser_annotations_type' must be 'xml' or 'csv' not {}.".format(
+            config['parser_annotation_type']))
+
+    if valid_imgs is None:
+        train_valid_split = int(0.8 * len(train_imgs))
+        np.random.shuffle(train_imgs)
+
+        valid_imgs = train_imgs[train_valid_split:]
+        train_imgs = train_imgs[:train_valid_split]
+
+    ########################
+    #   Construct the model
+    ########################
+    yolo = YOLO(backend=config['model']['backend'],
+                input_size=(config['model']['input_size_h'], config['model']['input_size_w']),
+                labels=config['model']['labels'],
+                anchors=config['model']['anchors'],
+                gray_mode=config['model']['gray_mode'])
+    yolo.load_weights(weights_path)
+
+    generator_config = {
+        'IMAGE_H': yolo._input_size[0],
+        'IMAGE_W': yolo._input_size[1],
+        'IMAGE_C': yolo._input_size[2],
+        'GRID_H': yolo._grid_h,
+        'GRID_W': yolo._grid_w,
+        'BOX': yolo._nb_box,
+        'LABELS': yolo.labels,
+        'CLASS': len(yolo.labels),
+        'ANCHORS': yolo._anchors,
+        'BATCH_SIZE': config['train']['batch_size'],
+    }
+    valid_generator = BatchGenerator(valid_imgs,
+                                     generator_config,
+                                     norm=yolo._feature_extractor.normalize,
+                                     jitter=False,
+                                     shuffle=False)
+    iou_threshold = config['valid']['iou_threshold']
+    score_threshold = config['valid']['score_threshold']
+
+    reports = [('original', report(yolo, valid_generator, iou_threshold, score_threshold))]
+
+    ###########################
+    #   Prune and fine-tune
+    ###########################
+    keep = yolo.prune_channels(args.ratio)
+    print("{} convolutions pruned: {}".format(len(keep), ', '.join(sorted(keep.keys()))))
+    reports.append(('pruned', report(yolo, valid_generator, iou_threshold, score_threshold)))
+
+    root, ext = os.path.splitext(weights_path)
+    if args.epochs > 0:
+        yolo.train(train_imgs=train_imgs,
+                   valid_imgs=valid_imgs,
+                   train_times=config['train']['train_times'],
+                   valid_times=config['valid']['valid_times'],
+                   nb_epochs=args.epochs,
+                   learning_rate=config['train']['learning_rate'],
+                   batch_size=config['train']['batch_size'],
+                   warmup_epochs=0,
+                   object_scale=config['train']['object_scale'],
+                   no_object_scale=config['train']['no_object_scale'],
+                   coord_scale=config['train']['coord_scale'],
+                   class_scale=config['train']['class_scale'],
+                   saved_weights_name=root + "_pruned" + ext,
+                   debug=config['train']['debug'],
+                   early_stop=config['train']['early_stop'],
+                   workers=config['train']['workers'],
+                   max_queue_size=config['train']['max_queue_size'],
+                   tb_logdir=config['train']['tensorboard_log_dir'],
+                   train_generator_callback=config['train']['callback'],
+                   iou_threshold=iou_threshold,
+                   score_threshold=score_threshold)
+        reports.append(('fine-tuned', report(yolo, valid_generator, iou_threshold, score_threshold)))
+
+    # the architecture changed, so the whole model is saved instead of the weights
+    pruned_path = root + "_pruned" + ext
+    yolo.get_inference_model().save(pruned_path)
+    print("Pruned model saved in", pruned_path)
+
+    print('\n{:<12} {:>12} {:>12} {:>14} {:>8}'.format('', 'GFLOPs', 'params', 'latency (ms)', 'mAP'))
+    for name, values in reports:
+        print('{:<12} {:>12.2f} {:>12,} {:>14.1f} {:>8.4f}'.format(name, values['flops'] / 1e9, values['params'],
+                                                                   values['latency'], values['mAP']))
+
+
+if __name__ == '__main__':
+    _args = argparser.parse_args()
+    _main_(_args)
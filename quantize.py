@@ -0,0 +1,146 @@
+#! /usr/bin/env python3
+from keras_yolov2.preprocessing import parse_annotation_xml, parse_annotation_csv
+from keras_yolov2.preprocessing import BatchGenerator
+from keras_yolov2.quantization import convert_to_int8, TFLiteYOLO
+from keras_yolov2.map_evaluation import MapEvaluation
+from keras_yolov2.utils import get_session
+from keras_yolov2.frontend import YOLO
+import argparse
+import keras
+import json
+import os
+
+argparser = argparse.ArgumentParser(
+    description='Export a YOLO_v2 model to an int8 TFLite model with post-training quantization')
+
+argparser.add_argument(
+    '-c',
+    '--conf',
+    default='config.json',
+    help='path to configuration file')
+
+argparser.add_argument(
+    '-w',
+    '--weights',
+    default='',
+    help='path to pretrained weights')
+
+argparser.add_argument(
+    '-n',
+    '--calibration_samples',
+    default=100,
+    type=int,
+    help='number of training images used to calibrate the quantization')
+
+argparser.add_argument(
+    '-i',
+    '--iou',
+    default=0.5,
+    type=float,
+    help='IOU threshold of the mAP comparison')
+
+
+def _main_(args):
+    config_path = args.conf
+    weights_path = args.weights
+
+    keras.backend.tensorflow_backend.set_session(get_session())
+
+    with open(config_path) as config_buffer:
+        config = json.load(config_buffer)
+
+    if weights_path == '':
+        weights_path = config['train']['saved_weights_name']
+
+    ##########################
+    #   Parse the annotations
+    ##########################
+    valid_imgs = []
+    if config['parser_annotation_type'] == 'xml':
+        train_imgs, _ = parse_annotation_xml(config['train']['train_annot_folder'],
+                                             config['train']['train_image_folder'],
+                                             config['model']['labels'],
+                                             cache_dir=config.get('annotation_cache_dir', ''))
+        if os.path.exists(config['valid']['valid_annot_folder']):
+            valid_imgs, _ = parse_annotation_xml(config['valid']['valid_annot_folder'],
+                                                 config['valid']['valid_image_folder'],
+                                                 config['model']['labels'],
+                                                 cache_dir=config.get('annotation_cache_dir', ''))
+    elif config['parser_annotation_type'] == 'csv':
+        train_imgs, _ = parse_annotation_csv(config['train']['train_csv_file'],
+                                             config['model']['labels'],
+                                             config['train']['train_csv_base_path'],
+                                             cache_dir=config.get('annotation_cache_dir', ''))
+        if os.path.exists(config['valid']['valid_csv_file']):
+            valid_imgs, _ = parse_annotation_csv(config['valid']['valid_csv_file'],
+                                                 config['model']['labels'],
+                                                 config['valid']['valid_csv_base_path'],
+                                                 cache_dir=config.get('annotation_cache_dir', ''))
+    else:
+        raise ValueError("'parser_annotations_type' must be 'xml' or 'csv' not {}.".format(
+            config['parser_annotation_type']))
+
+    ########################
+    #   Construct the model
+    ########################
+    yolo = YOLO(backend=config['model']['backend'],
+                input_size=(config['model']['input_size_h'], config['model']['input_size_w']),
+                labels=config['model']['labels'],
+                anchors=config['model']['anchors'],
+                gray_mode=config['model']['gray_mode'])
+    yolo.load_weights(weights_path)
+
+    generator_config = {
+        'IMAGE_H': yolo._input_size[0],
+        'IMAGE_W': yolo._input_size[1],
+        'IMAGE_C': yolo._input_size[2],
+        'GRID_H': yolo._grid_h,
+        'GRID_W': yolo._grid_w,
+        'BOX': yolo._nb_box,
+        'LABELS': yolo.labels,
+        'CLASS': len(yolo.labels),
+        'ANCHORS': yolo._anchors,
+        'BATCH_SIZE': 4,
+    }
+
+    ################################
+    #   Quantize with calibration
+    ################################
+    calibration_generator = BatchGenerator(train_imgs,
+                                           generator_config,
+                                           norm=yolo._feature_extractor.normalize,
+                                           jitter=False)
+
+    tflite_path = "{}_int8.tflite".format(os.path.splitext(weights_path)[0])
+    print("Calibrating on {} images".format(min(args.calibration_samples, len(train_imgs))))
+    convert_to_int8(yolo, calibration_generator, tflite_path, nb_samples=args.calibration_samples)
+    print("Quantized model saved in", tflite_path)
+
+    #################################
+    #   Compare float and int8 mAP
+    #################################
+    tflite_yolo = TFLiteYOLO(tflite_path,
+                             labels=yolo.labels,
+                             anchors=yolo._anchors,
+                             normalize=yolo._feature_extractor.normalize,
+                             gray_mode=config['model']['gray_mode'])
+
+    eval_imgs = valid_imgs if len(valid_imgs) > 0 else train_imgs
+    eval_generator = BatchGenerator(eval_imgs,
+                                    generator_config,
+                                    norm=yolo._feature_extractor.normalize,
+                                    jitter=False,
+                                    shuffle=False)
+
+    float_map, float_aps = MapEvaluation(yolo, eval_generator, iou_threshold=args.iou).evaluate_map()
+    int8_map, int8_aps = MapEvaluation(tflite_yolo, eval_generator, iou_threshold=args.iou).evaluate_map()
+
+    print('{:<20} {:>8} {:>8}'.format('label', 'float', 'int8'))
+    for label in float_aps:
+        print('{:<20} {:>8.4f} {:>8.4f}'.format(yolo.labels[label], float_aps[label], int8_aps[label]))
+    print('{:<20} {:>8.4f} {:>8.4f}'.format('mAP', float_map, int8_map))
+
+
+if __name__ == '__main__':
+    _args = argparser.parse_args()
+    _main_(_args)
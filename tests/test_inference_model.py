@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+
+from keras.layers import Activation, Input
+from keras.models import Model
+
+from keras_yolov2.frontend import YOLO
+from keras_yolov2.utils import decode_netout
+
+ANCHORS = [0.57273, 0.677385, 1.87446, 2.06253, 3.33843, 5.47434, 7.88282, 3.52778]
+
+
+def _netout_yolo(grid_h, grid_w, nb_class, anchors=ANCHORS):
+    # a YOLO whose model returns its input, so the decoded model is fed with a raw netout
+    netout = Input(shape=(grid_h, grid_w, len(anchors) // 2, 4 + 1 + nb_class))
+    yolo = YOLO.__new__(YOLO)
+    yolo._model = Model(netout, Activation('linear')(netout))
+    yolo._anchors = anchors
+    return yolo
+
+
+def _assert_same_detections(yolo, netout, iou_threshold, score_threshold, max_boxes=1000):
+    model = yolo.get_inference_model(decode=True, max_boxes=max_boxes, iou_threshold=iou_threshold,
+                                     score_threshold=score_threshold)
+    boxes, scores, classes, valid_detections = model.predict(netout)
+
+    for i in range(netout.shape[0]):
+        detections = decode_netout(netout[i].copy(), yolo._anchors, netout.shape[-1] - 5, score_threshold,
+                                   iou_threshold, as_detections=True)
+        # the decoded model sorts the detections by score
+        order = np.argsort(-detections.scores, kind='mergesort')
+
+        assert valid_detections[i] == len(order)
+        np.testing.assert_allclose(boxes[i, :len(order)], detections.boxes[order], atol=1e-5)
+        np.testing.assert_allclose(scores[i, :len(order)], detections.scores[order], atol=1e-5)
+        np.testing.assert_array_equal(classes[i, :len(order)], detections.labels[order])
+        np.testing.assert_array_equal(classes[i, len(order):], -1)
+
+
+@pytest.mark.parametrize('class_scale', [1., 60.])
+@pytest.mark.parametrize('iou_threshold,score_threshold', [(0.3, 0.1), (0.5, 0.3), (0.7, 0.5)])
+def test_decoded_model_matches_decode_netout(class_scale, iou_threshold, score_threshold):
+    rng = np.random.RandomState(0)
+    netout = rng.randn(4, 7, 9, len(ANCHORS) // 2, 4 + 1 + 3).astype(np.float32)
+    # large logits go through the rescaling of the softmax
+    netout[..., 5:] *= class_scale
+
+    _assert_same_detections(_netout_yolo(7, 9, 3), netout, iou_threshold, score_threshold)
+
+
+def test_decoded_model_suppresses_boxes_at_the_iou_threshold():
+    anchors = [1., 1., 1., 1.]
+    netout = np.zeros((1, 3, 3, 2, 4 + 1 + 2), dtype=np.float32)
+    netout[..., 4] = -10.
+    # two identical boxes of the same class, their IoU of 1 reaches the threshold, so only one is kept
+    netout[0, 1, 1, :, 4] = 5.
+    netout[0, 1, 1, :, 5] = 3.
+    netout[0, 1, 1, 1, 4] = 4.
+
+    _assert_same_detections(_netout_yolo(3, 3, 2, anchors), netout, iou_threshold=1., score_threshold=0.3)
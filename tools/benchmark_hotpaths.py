@@ -0,0 +1,232 @@
+import sys
+
+sys.path.append("..")
+from keras_yolov2.utils import BoundBox, Detections, bbox_iou, compute_ap, compute_overlap, decode_netout
+from keras_yolov2.preprocessing import BatchGenerator
+from keras_yolov2.map_evaluation import MapEvaluation
+import numpy as np
+import argparse
+import tempfile
+import timeit
+import shutil
+import atexit
+import json
+import cv2
+import os
+
+argparser = argparse.ArgumentParser(
+    description='Micro-benchmarks of the numpy hot paths on synthetic data, with a baseline comparison mode')
+
+argparser.add_argument(
+    '-k',
+    '--filter',
+    default='',
+    help='only run the benchmarks whose name contains this string')
+
+argparser.add_argument(
+    '-r',
+    '--repeats',
+    default=5,
+    type=int,
+    help='number of timed repeats per benchmark, the median is kept')
+
+argparser.add_argument(
+    '-s',
+    '--save',
+    default='',
+    help='save the results as a baseline json file')
+
+argparser.add_argument(
+    '-c',
+    '--compare',
+    default='',
+    help='baseline json file to compare against')
+
+argparser.add_argument(
+    '-m',
+    '--max_regression',
+    default=10.,
+    type=float,
+    help='maximum slowdown in percent allowed against the baseline, the script exits with an error above it')
+
+BENCHMARKS = []
+NB_ANCHORS = 5
+ANCHORS = [0.57273, 0.677385, 1.87446, 2.06253, 3.33843, 5.47434, 7.88282, 3.52778, 9.77052, 9.16828]
+
+
+def benchmark(name, cases):
+    """
+    Register a benchmark, the decorated function receives the parameters of a case, prepares the synthetic data and
+    returns the function to time.
+    :param name: name of the benchmark
+    :param cases: list of dicts with the parameters of each case
+    """
+    def register(setup):
+        for params in cases:
+            case_name = '{}[{}]'.format(name, ','.join('{}={}'.format(key, value) for key, value in params.items()))
+            BENCHMARKS.append((case_name, setup, params))
+        return setup
+    return register
+
+
+def _temporary_folder():
+    folder = tempfile.mkdtemp(prefix='yolo_benchmark_')
+    atexit.register(shutil.rmtree, folder, True)
+    return folder
+
+
+def _random_boxes(nb_boxes, width=1., height=1.):
+    x1 = np.random.uniform(0, width * 0.9, nb_boxes)
+    y1 = np.random.uniform(0, height * 0.9, nb_boxes)
+    x2 = x1 + np.random.uniform(width * 0.02, width * 0.1, nb_boxes)
+    y2 = y1 + np.random.uniform(height * 0.02, height * 0.1, nb_boxes)
+    return np.stack([x1, y1, x2, y2], axis=-1)
+
+
+def _synthetic_dataset(nb_images, nb_objects, labels, image_size=(480, 640)):
+    """
+    Write random jpg images into a temporary folder.
+    :return: list of images in the format returned by the annotation parsers
+    """
+    folder = _temporary_folder()
+    image_h, image_w = image_size
+
+    images = []
+    for i in range(nb_images):
+        filename = os.path.join(folder, '{}.jpg'.format(i))
+        cv2.imwrite(filename, np.random.randint(0, 256, size=(image_h, image_w, 3), dtype=np.uint8))
+
+        objects = [{'name': labels[np.random.randint(len(labels))],
+                    'xmin': int(x1), 'ymin': int(y1), 'xmax': int(x2), 'ymax': int(y2)}
+                   for x1, y1, x2, y2 in _random_boxes(nb_objects, image_w, image_h)]
+        images.append({'filename': filename, 'width': image_w, 'height': image_h, 'object': objects})
+
+    return images
+
+
+def _generator_config(labels, batch_size, input_size=416, grid_size=13):
+    return {'IMAGE_H': input_size,
+            'IMAGE_W': input_size,
+            'IMAGE_C': 3,
+            'GRID_H': grid_size,
+            'GRID_W': grid_size,
+            'BOX': NB_ANCHORS,
+            'LABELS': labels,
+            'CLASS': len(labels),
+            'ANCHORS': ANCHORS,
+            'BATCH_SIZE': batch_size}
+
+
+class _RandomPredictor(object):
+    """
+    Stands in for YOLO in MapEvaluation, returning random detections so only the evaluation itself is timed.
+    """
+
+    def __init__(self, labels, nb_boxes):
+        self.labels = labels
+        self._nb_boxes = nb_boxes
+
+    def predict_batch(self, images, batch_size=8, iou_threshold=0.5, score_threshold=0.5, as_detections=True):
+        return [Detections(_random_boxes(self._nb_boxes),
+                           np.random.uniform(score_threshold, 1., self._nb_boxes),
+                           np.random.randint(len(self.labels), size=self._nb_boxes))
+                for _ in images]
+
+
+@benchmark('decode_netout', [{'grid': grid, 'classes': classes} for grid in (7, 13, 19) for classes in (1, 20, 80)])
+def bench_decode_netout(grid, classes):
+    netout = np.random.normal(size=(grid, grid, NB_ANCHORS, 4 + 1 + classes)).astype(np.float32)
+    return lambda: decode_netout(netout, ANCHORS, classes, obj_threshold=0.3, nms_threshold=0.3, as_detections=True)
+
+
+@benchmark('bbox_iou', [{'pairs': pairs} for pairs in (100, 1000)])
+def bench_bbox_iou(pairs):
+    boxes = [(BoundBox(*a), BoundBox(*b)) for a, b in zip(_random_boxes(pairs), _random_boxes(pairs))]
+    return lambda: [bbox_iou(a, b) for a, b in boxes]
+
+
+@benchmark('compute_overlap', [{'boxes': boxes, 'annotations': annotations}
+                               for boxes, annotations in ((10, 10), (100, 100), (1000, 100))])
+def bench_compute_overlap(boxes, annotations):
+    a = _random_boxes(boxes, 640, 480)
+    b = _random_boxes(annotations, 640, 480)
+    return lambda: compute_overlap(a, b)
+
+
+@benchmark('compute_ap', [{'detections': detections} for detections in (100, 1000, 10000)])
+def bench_compute_ap(detections):
+    true_positives = np.cumsum(np.random.randint(2, size=detections))
+    recall = true_positives / float(max(true_positives[-1], 1))
+    precision = true_positives / np.arange(1, detections + 1, dtype=np.float64)
+    return lambda: compute_ap(recall, precision)
+
+
+@benchmark('BatchGenerator.__getitem__', [{'objects': objects, 'jitter': jitter}
+                                          for objects in (1, 10) for jitter in (False, True)])
+def bench_batch_generator(objects, jitter):
+    labels = [str(i) for i in range(20)]
+    images = _synthetic_dataset(8, objects, labels)
+    generator = BatchGenerator(images, _generator_config(labels, 8), jitter=jitter, norm=lambda image: image / 255.)
+    return lambda: generator[0]
+
+
+@benchmark('MapEvaluation._calc_avg_precisions', [{'images': images, 'boxes': boxes}
+                                                  for images in (50, 200) for boxes in (10, 100)])
+def bench_map_evaluation(images, boxes):
+    labels = [str(i) for i in range(20)]
+    dataset = _synthetic_dataset(images, 10, labels, image_size=(64, 64))
+    generator = BatchGenerator(dataset, _generator_config(labels, 8), shuffle=False, jitter=False)
+    evaluation = MapEvaluation(_RandomPredictor(labels, boxes), generator)
+    return evaluation._calc_avg_precisions
+
+
+def run(setup, params, repeats):
+    np.random.seed(0)
+    function = setup(**params)
+
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    times = np.array(timer.repeat(repeats, number)) / number
+
+    return float(np.median(times))
+
+
+def main(args):
+    baseline = {}
+    if args.compare != '':
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {}
+    regressions = []
+    print('{:<60} {:>12} {:>12} {:>9}'.format('benchmark', 'time (ms)', 'baseline', 'change'))
+    for name, setup, params in BENCHMARKS:
+        if args.filter not in name:
+            continue
+
+        results[name] = run(setup, params, args.repeats)
+
+        line = '{:<60} {:>12.4f}'.format(name, results[name] * 1000)
+        if name in baseline:
+            change = (results[name] - baseline[name]) / baseline[name] * 100
+            line += ' {:>12.4f} {:>+8.1f}%'.format(baseline[name] * 1000, change)
+            if change > args.max_regression:
+                regressions.append(name)
+                line += '  REGRESSION'
+        print(line)
+
+    if args.save != '':
+        with open(args.save, 'w') as outfile:
+            json.dump(results, outfile, indent=4, sort_keys=True)
+
+    if len(regressions) > 0:
+        print('\n{} benchmarks are more than {}% slower than the baseline:'.format(len(regressions),
+                                                                                 args.max_regression))
+        for name in regressions:
+            print('  ' + name)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    _args = argparser.parse_args()
+    main(_args)
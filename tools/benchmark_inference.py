@@ -0,0 +1,180 @@
+import sys
+
+sys.path.append("..")
+from keras_yolov2.utils import get_session, preprocess_image, _decode_grid, _suppress_boxes
+from keras_yolov2.frontend import YOLO
+from keras_yolov2 import backend
+import numpy as np
+import argparse
+import keras
+import json
+import time
+
+argparser = argparse.ArgumentParser(
+    description='Measure the inference latency of the backends, with random weights and synthetic images')
+
+argparser.add_argument(
+    '-b',
+    '--backends',
+    nargs='+',
+    default=['Tiny Yolo', 'Full Yolo'],
+    help='backends to measure, a custom backend can be given by its path like in the config file')
+
+argparser.add_argument(
+    '-s',
+    '--input_sizes',
+    nargs='+',
+    default=[416],
+    type=int,
+    help='input sizes of the models')
+
+argparser.add_argument(
+    '-n',
+    '--batch_sizes',
+    nargs='+',
+    default=[1, 8],
+    type=int,
+    help='number of images per forward pass')
+
+argparser.add_argument(
+    '-i',
+    '--iterations',
+    default=50,
+    type=int,
+    help='number of measured batches per configuration')
+
+argparser.add_argument(
+    '-w',
+    '--warmup',
+    default=5,
+    type=int,
+    help='number of batches run before measuring')
+
+argparser.add_argument(
+    '--classes',
+    default=20,
+    type=int,
+    help='number of classes of the models')
+
+argparser.add_argument(
+    '--image_size',
+    default='480x640',
+    help='HxW of the synthetic images, they are resized during the preprocessing')
+
+argparser.add_argument(
+    '--score_threshold',
+    default=0.05,
+    type=float,
+    help='score threshold of the decoding, random weights give low scores so a low threshold keeps some boxes')
+
+argparser.add_argument(
+    '--iou_threshold',
+    default=0.5,
+    type=float,
+    help='IoU threshold of the non max suppression')
+
+argparser.add_argument(
+    '-o',
+    '--output',
+    default='',
+    help='optional path of a json file with the results')
+
+STAGES = ['preprocess', 'forward', 'decode', 'nms', 'total']
+DEFAULT_ANCHORS = [0.57273, 0.677385, 1.87446, 2.06253, 3.33843, 5.47434, 7.88282, 3.52778, 9.77052, 9.16828]
+
+
+def run_batch(yolo, images, args):
+    """
+    Predict a batch like YOLO.predict_batch does, timing each stage.
+    :return: dict with the seconds spent in each stage
+    """
+    timings = {}
+
+    start = time.time()
+    input_images = np.empty((len(images),) + yolo._input_size, dtype=np.float32)
+    for i, image in enumerate(images):
+        input_images[i] = preprocess_image(image, yolo._input_size, yolo._feature_extractor.normalize,
+                                           yolo._gray_mode)
+    timings['preprocess'] = time.time() - start
+
+    start = time.time()
+    netouts = yolo._model.predict_on_batch(input_images)
+    timings['forward'] = time.time() - start
+
+    timings['decode'] = 0.
+    timings['nms'] = 0.
+    for netout in netouts:
+        start = time.time()
+        boxes, _, classes = _decode_grid(netout, yolo._anchors, args.score_threshold)
+        timings['decode'] += time.time() - start
+
+        start = time.time()
+        _suppress_boxes(boxes, classes, args.score_threshold, args.iou_threshold)
+        timings['nms'] += time.time() - start
+
+    timings['total'] = sum(timings.values())
+    return timings
+
+
+def benchmark(yolo, backend_name, input_size, batch_size, images, args):
+    batch = images[:batch_size]
+    for _ in range(args.warmup):
+        run_batch(yolo, batch, args)
+
+    runs = [run_batch(yolo, batch, args) for _ in range(args.iterations)]
+
+    result = {'backend': backend_name, 'input_size': input_size, 'batch_size': batch_size}
+    for stage in STAGES:
+        latencies = np.array([run[stage] for run in runs]) * 1000
+        result[stage] = {'p50': float(np.percentile(latencies, 50)),
+                         'p95': float(np.percentile(latencies, 95)),
+                         'p99': float(np.percentile(latencies, 99))}
+    result['images_per_second'] = batch_size * len(runs) / sum(run['total'] for run in runs)
+
+    return result
+
+
+def print_result(result):
+    print('\n{} {}x{} batch {}: {:.1f} images/s'.format(result['backend'], result['input_size'],
+                                                        result['input_size'], result['batch_size'],
+                                                        result['images_per_second']))
+    print('{:<12} {:>10} {:>10} {:>10}'.format('stage (ms)', 'p50', 'p95', 'p99'))
+    for stage in STAGES:
+        print('{:<12} {:>10.2f} {:>10.2f} {:>10.2f}'.format(stage, result[stage]['p50'], result[stage]['p95'],
+                                                            result[stage]['p99']))
+
+
+def main(args):
+    # random weights, so nothing is downloaded
+    backend.APPLICATIONS_WEIGHTS = None
+
+    image_h, image_w = [int(size) for size in args.image_size.split('x')]
+    images = [np.random.randint(0, 256, size=(image_h, image_w, 3), dtype=np.uint8)
+              for _ in range(max(args.batch_sizes))]
+
+    results = []
+    for backend_name in args.backends:
+        for input_size in args.input_sizes:
+            # a new graph for each model, so the previous ones do not slow down this one
+            keras.backend.clear_session()
+            keras.backend.tensorflow_backend.set_session(get_session())
+
+            yolo = YOLO(backend=backend_name,
+                        input_size=(input_size, input_size),
+                        labels=[str(i) for i in range(args.classes)],
+                        anchors=DEFAULT_ANCHORS,
+                        verbose=False)
+
+            for batch_size in args.batch_sizes:
+                result = benchmark(yolo, backend_name, input_size, batch_size, images, args)
+                print_result(result)
+                results.append(result)
+
+    if args.output != '':
+        with open(args.output, 'w') as outfile:
+            json.dump(results, outfile, indent=4)
+
+
+if __name__ == '__main__':
+    _args = argparser.parse_args()
+    main(_args)
@@ -0,0 +1,141 @@
+import sys
+
+sys.path.append("..")
+import numpy as np
+import subprocess
+import argparse
+import json
+import time
+import os
+
+BACKENDS = ['Tiny Yolo', 'Full Yolo', 'MobileNet', 'SqueezeNet', 'Inception3', 'VGG16', 'ResNet50']
+
+argparser = argparse.ArgumentParser(
+    description='Measure the startup time of a predictor, each measure runs in a new python process')
+
+argparser.add_argument(
+    '-b',
+    '--backends',
+    nargs='+',
+    default=BACKENDS,
+    help='backends to measure')
+
+argparser.add_argument(
+    '-s',
+    '--input_size',
+    default=416,
+    type=int,
+    help='input size of the models')
+
+argparser.add_argument(
+    '-f',
+    '--frozen',
+    default='',
+    help='optional frozen graph written by get_inference.py --freeze, to measure the start of FrozenYOLO too')
+
+argparser.add_argument(
+    '-r',
+    '--repeats',
+    default=3,
+    type=int,
+    help='number of processes started per measure, the median is reported')
+
+argparser.add_argument(
+    '-o',
+    '--output',
+    default='',
+    help='optional path of a json file with the results')
+
+argparser.add_argument(
+    '--child',
+    default='',
+    help=argparse.SUPPRESS)
+
+
+def measure_backend(backend, input_size):
+    start = time.time()
+    from keras_yolov2.frontend import YOLO
+    from keras_yolov2 import backend as yolo_backend
+    import_time = time.time() - start
+
+    # random weights, so nothing is downloaded and the build time does not depend on the network
+    yolo_backend.APPLICATIONS_WEIGHTS = None
+
+    start = time.time()
+    yolo = YOLO(backend=backend,
+                input_size=(input_size, input_size),
+                labels=['object'],
+                anchors=[1., 1.],
+                verbose=False)
+    build_time = time.time() - start
+
+    image = np.random.randint(0, 256, size=(input_size, input_size, 3), dtype=np.uint8)
+    start = time.time()
+    yolo.predict(image)
+    first_predict_time = time.time() - start
+
+    return {'import': import_time, 'build': build_time, 'first_predict': first_predict_time}
+
+
+def measure_frozen(graph_path):
+    start = time.time()
+    from keras_yolov2.frozen import FrozenYOLO
+    import_time = time.time() - start
+
+    start = time.time()
+    yolo = FrozenYOLO(graph_path)
+    build_time = time.time() - start
+
+    image = np.random.randint(0, 256, size=yolo._input_size[:2] + (3,), dtype=np.uint8)
+    start = time.time()
+    yolo.predict(image)
+    first_predict_time = time.time() - start
+
+    return {'import': import_time, 'build': build_time, 'first_predict': first_predict_time}
+
+
+def run_child(name, args):
+    """
+    Start a new python process measuring one predictor and return its timings.
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--child', name, '-s', str(args.input_size)]
+    if name == 'frozen':
+        command += ['-f', args.frozen]
+    output = subprocess.run(command, stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+
+    # the backends print some messages, the timings are on the last line
+    return json.loads(output.strip().split('\n')[-1])
+
+
+def main(args):
+    if args.child != '':
+        if args.child == 'frozen':
+            timings = measure_frozen(args.frozen)
+        else:
+            timings = measure_backend(args.child, args.input_size)
+        print(json.dumps(timings))
+        return
+
+    names = list(args.backends)
+    if args.frozen != '':
+        names.append('frozen')
+
+    results = {}
+    print('{:<12} {:>10} {:>10} {:>15} {:>10}'.format('predictor', 'import', 'build', 'first predict', 'total'))
+    for name in names:
+        runs = [run_child(name, args) for _ in range(args.repeats)]
+        timings = {key: float(np.median([run[key] for run in runs])) for key in runs[0]}
+        timings['total'] = timings['import'] + timings['build'] + timings['first_predict']
+        results[name] = timings
+
+        print('{:<12} {:>9.2f}s {:>9.2f}s {:>14.2f}s {:>9.2f}s'.format(name, timings['import'], timings['build'],
+                                                                       timings['first_predict'], timings['total']))
+
+    if args.output != '':
+        with open(args.output, 'w') as outfile:
+            json.dump(results, outfile, indent=4)
+
+
+if __name__ == '__main__':
+    _args = argparser.parse_args()
+    main(_args)
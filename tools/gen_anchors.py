@@ -117,30 +117,37 @@ def main(args):
         # parse annotations of the training set
         train_imgs, train_labels = parse_annotation_xml(config['train']['train_annot_folder'], 
                                                         config['train']['train_image_folder'],
-                                                        config['model']['labels'])
+                                                        config['model']['labels'],
+                                                        cache_dir=config.get('annotation_cache_dir', ''),
+                                                        as_table=True)
     elif config['parser_annotation_type'] == 'csv':
         # parse annotations of the training set
         train_imgs, train_labels = parse_annotation_csv(config['train']['train_csv_file'],
                                                         config['model']['labels'],
-                                                        config['train']['train_csv_base_path'])
+                                                        config['train']['train_csv_base_path'],
+                                                        cache_dir=config.get('annotation_cache_dir', ''),
+                                                        as_table=True)
 
     input_size = (config['model']['input_size_h'], config['model']['input_size_w'], 3)
     feature_extractor = import_feature_extractor(config['model']['backend'], input_size)
     grid_w = config['model']['input_size_w']/feature_extractor.get_output_shape()[1]
     grid_h = config['model']['input_size_h']/feature_extractor.get_output_shape()[0]
 
-    # run k_mean to find the anchors
-    annotation_dims = []
-    for image in train_imgs:
-        cell_w = image['width']/grid_w
-        cell_h = image['height']/grid_h
-
-        for obj in image['object']:
-            relative_w = (float(obj['xmax']) - float(obj['xmin']))/cell_w
-            relatice_h = (float(obj["ymax"]) - float(obj['ymin']))/cell_h
-            annotation_dims.append(tuple(map(float, (relative_w, relatice_h))))
+    # the images whose size could not be read have no cell size
+    known_size = (train_imgs.widths > 0) & (train_imgs.heights > 0)
+    if not known_size.all():
+        print("{} images without width or height are skipped.".format(np.sum(~known_size)))
+    annotations = train_imgs.subset(np.flatnonzero(known_size))
 
-    annotation_dims = np.array(annotation_dims)
+    # run k_mean to find the anchors
+    image_indices = annotations.box_image_indices()
+    cell_w = annotations.widths[image_indices]/grid_w
+    cell_h = annotations.heights[image_indices]/grid_h
+
+    boxes = annotations.boxes.astype(np.float64)
+    relative_w = (boxes[:, 2] - boxes[:, 0])/cell_w
+    relative_h = (boxes[:, 3] - boxes[:, 1])/cell_h
+    annotation_dims = np.stack([relative_w, relative_h], axis=1)
     centroids = run_kmeans(annotation_dims, num_anchors)
 
     # write anchors to file
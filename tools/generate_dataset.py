@@ -0,0 +1,212 @@
+import sys
+
+sys.path.append("..")
+from multiprocessing import Pool
+import xml.etree.ElementTree as et
+import numpy as np
+import argparse
+import json
+import cv2
+import os
+
+argparser = argparse.ArgumentParser(
+    description='Write a synthetic dataset of random shapes with their boxes, as a csv file or as VOC xml files')
+
+argparser.add_argument(
+    '-o',
+    '--output',
+    default='synthetic_dataset',
+    help='output folder, the images are written in its images folder')
+
+argparser.add_argument(
+    '-f',
+    '--format',
+    default='csv',
+    choices=['csv', 'xml'],
+    help='annotation format, the same as parser_annotation_type in the config file')
+
+argparser.add_argument(
+    '-n',
+    '--images',
+    default=1000,
+    type=int,
+    help='number of images')
+
+argparser.add_argument(
+    '-s',
+    '--image_size',
+    default='480x640',
+    help='HxW of the images')
+
+argparser.add_argument(
+    '-b',
+    '--objects',
+    default='1-10',
+    help='number of objects per image, a single value or a min-max range')
+
+argparser.add_argument(
+    '-c',
+    '--classes',
+    default=3,
+    type=int,
+    help='number of classes, each class has its own shape and color')
+
+argparser.add_argument(
+    '-w',
+    '--workers',
+    default=os.cpu_count(),
+    type=int,
+    help='number of processes writing the images')
+
+argparser.add_argument(
+    '--seed',
+    default=0,
+    type=int,
+    help='seed of the random generator, the same seed gives the same dataset')
+
+SHAPES = ['rectangle', 'ellipse', 'triangle']
+CHUNK_SIZE = 100
+
+
+def class_style(class_id):
+    """
+    :return: shape and BGR color of a class, the same for all the images
+    """
+    color = np.random.RandomState(class_id).randint(64, 256, size=3)
+    return SHAPES[class_id % len(SHAPES)], tuple(int(c) for c in color)
+
+
+def draw_object(image, shape, color, box):
+    xmin, ymin, xmax, ymax = box
+    if shape == 'rectangle':
+        cv2.rectangle(image, (xmin, ymin), (xmax, ymax), color, -1)
+    elif shape == 'ellipse':
+        center = ((xmin + xmax) // 2, (ymin + ymax) // 2)
+        cv2.ellipse(image, center, ((xmax - xmin) // 2, (ymax - ymin) // 2), 0, 0, 360, color, -1)
+    else:
+        points = np.array([[(xmin + xmax) // 2, ymin], [xmin, ymax], [xmax, ymax]], dtype=np.int32)
+        cv2.fillPoly(image, [points], color)
+
+
+def generate_image(rng, image_h, image_w, min_objects, max_objects, nb_classes):
+    """
+    :return: the image and a list of (xmin, ymin, xmax, ymax, class_id)
+    """
+    # noisy gradient background, so the shapes are not the only content of the image
+    background = np.linspace(rng.randint(0, 128), rng.randint(0, 128), image_w, dtype=np.float32)
+    image = np.tile(background[np.newaxis, :, np.newaxis], (image_h, 1, 3))
+    image += rng.normal(0, 10, size=image.shape)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+
+    objects = []
+    for _ in range(rng.randint(min_objects, max_objects + 1)):
+        class_id = rng.randint(nb_classes)
+        box_w = rng.randint(max(image_w // 20, 2), max(image_w // 3, 3))
+        box_h = rng.randint(max(image_h // 20, 2), max(image_h // 3, 3))
+        xmin = rng.randint(0, image_w - box_w)
+        ymin = rng.randint(0, image_h - box_h)
+        box = (xmin, ymin, xmin + box_w, ymin + box_h)
+
+        shape, color = class_style(class_id)
+        draw_object(image, shape, color, box)
+        objects.append(box + (class_id,))
+
+    return image, objects
+
+
+def write_xml(path, filename, image_h, image_w, objects, labels):
+    annotation = et.Element('annotation')
+    et.SubElement(annotation, 'filename').text = filename
+    size = et.SubElement(annotation, 'size')
+    et.SubElement(size, 'width').text = str(image_w)
+    et.SubElement(size, 'height').text = str(image_h)
+    et.SubElement(size, 'depth').text = '3'
+
+    for xmin, ymin, xmax, ymax, class_id in objects:
+        obj = et.SubElement(annotation, 'object')
+        et.SubElement(obj, 'name').text = labels[class_id]
+        bndbox = et.SubElement(obj, 'bndbox')
+        et.SubElement(bndbox, 'xmin').text = str(xmin)
+        et.SubElement(bndbox, 'ymin').text = str(ymin)
+        et.SubElement(bndbox, 'xmax').text = str(xmax)
+        et.SubElement(bndbox, 'ymax').text = str(ymax)
+
+    et.ElementTree(annotation).write(path)
+
+
+def generate_chunk(task):
+    """
+    Write the images of one chunk, each chunk has its own random generator so the result does not depend on the
+    number of workers.
+    :return: the csv lines of the chunk, empty for the xml format
+    """
+    first_image, last_image, args = task
+    image_h, image_w = [int(size) for size in args.image_size.split('x')]
+    min_objects, max_objects = parse_range(args.objects)
+    labels = class_labels(args.classes)
+    rng = np.random.RandomState(args.seed * 1000003 + first_image)
+
+    lines = []
+    for i in range(first_image, last_image):
+        filename = '{:08d}.jpg'.format(i)
+        image, objects = generate_image(rng, image_h, image_w, min_objects, max_objects, args.classes)
+        cv2.imwrite(os.path.join(args.output, 'images', filename), image)
+
+        if args.format == 'xml':
+            write_xml(os.path.join(args.output, 'annotations', '{:08d}.xml'.format(i)), filename, image_h, image_w,
+                      objects, labels)
+        elif len(objects) == 0:
+            # a line without class is a background image
+            lines.append('images/{},,,,,\n'.format(filename))
+        else:
+            lines.extend('images/{},{},{},{},{},{}\n'.format(filename, xmin, ymin, xmax, ymax, labels[class_id])
+                         for xmin, ymin, xmax, ymax, class_id in objects)
+
+    return lines
+
+
+def parse_range(value):
+    bounds = [int(bound) for bound in value.split('-')]
+    return bounds[0], bounds[-1]
+
+
+def class_labels(nb_classes):
+    return ['{}_{}'.format(class_style(i)[0], i) for i in range(nb_classes)]
+
+
+def main(args):
+    os.makedirs(os.path.join(args.output, 'images'), exist_ok=True)
+    if args.format == 'xml':
+        os.makedirs(os.path.join(args.output, 'annotations'), exist_ok=True)
+
+    tasks = [(first_image, min(first_image + CHUNK_SIZE, args.images), args)
+             for first_image in range(0, args.images, CHUNK_SIZE)]
+
+    nb_boxes = 0
+    csv_path = os.path.join(args.output, 'annotations.csv')
+    with Pool(args.workers) as pool, open(csv_path if args.format == 'csv' else os.devnull, 'w') as csv_file:
+        # the chunks come back in order, so the csv file is the same whatever the number of workers
+        for i, lines in enumerate(pool.imap(generate_chunk, tasks)):
+            csv_file.writelines(lines)
+            nb_boxes += len(lines)
+            print('\r{}/{} images'.format(tasks[i][1], args.images), end='')
+    print()
+
+    labels = class_labels(args.classes)
+    if args.format == 'csv':
+        print('{} lines written in {}'.format(nb_boxes, csv_path))
+        config = {'parser_annotation_type': 'csv',
+                  'train_csv_file': csv_path,
+                  'train_csv_base_path': args.output}
+    else:
+        config = {'parser_annotation_type': 'xml',
+                  'train_image_folder': os.path.join(args.output, 'images', ''),
+                  'train_annot_folder': os.path.join(args.output, 'annotations', '')}
+
+    print('Config values for this dataset:')
+    print(json.dumps(dict(config, labels=labels), indent=4))
+
+
+if __name__ == '__main__':
+    _args = argparser.parse_args()
+    main(_args)
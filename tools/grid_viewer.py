@@ -26,12 +26,14 @@ def main(args):
         # parse annotations of the training set
         train_imgs, train_labels = parse_annotation_xml(config['train']['train_annot_folder'],
                                                         config['train']['train_image_folder'],
-                                                        config['model']['labels'])
+                                                        config['model']['labels'],
+                                                        cache_dir=config.get('annotation_cache_dir', ''))
     elif config['parser_annotation_type'] == 'csv':
         # parse annotations of the training set
         train_imgs, train_labels = parse_annotation_csv(config['train']['train_csv_file'],
                                                         config['model']['labels'],
-                                                        config['train']['train_csv_base_path'])
+                                                        config['train']['train_csv_base_path'],
+                                                        cache_dir=config.get('annotation_cache_dir', ''))
 
     input_size = (config['model']['input_size_h'], config['model']['input_size_w'], 3)
     feature_extractor = import_feature_extractor(config['model']['backend'], input_size)
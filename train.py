@@ -37,13 +37,17 @@ def _main_(args):
         # parse annotations of the training set
         train_imgs, train_labels = parse_annotation_xml(config['train']['train_annot_folder'],
                                                         config['train']['train_image_folder'],
-                                                        config['model']['labels'])
+                                                        config['model']['labels'],
+                                                        cache_dir=config.get('annotation_cache_dir', ''),
+                                                        as_table=True)
 
         # parse annotations of the validation set, if any, otherwise split the training set
         if os.path.exists(config['valid']['valid_annot_folder']):
             valid_imgs, valid_labels = parse_annotation_xml(config['valid']['valid_annot_folder'],
                                                             config['valid']['valid_image_folder'],
-                                                            config['model']['labels'])
+                                                            config['model']['labels'],
+                                                            cache_dir=config.get('annotation_cache_dir', ''),
+                                                            as_table=True)
             split = False
         else:
             split = True
@@ -51,13 +55,17 @@ def _main_(args):
         # parse annotations of the training set
         train_imgs, train_labels = parse_annotation_csv(config['train']['train_csv_file'],
                                                         config['model']['labels'],
-                                                        config['train']['train_csv_base_path'])
+                                                        config['train']['train_csv_base_path'],
+                                                        cache_dir=config.get('annotation_cache_dir', ''),
+                                                        as_table=True)
 
         # parse annotations of the validation set, if any, otherwise split the training set
         if os.path.exists(config['valid']['valid_csv_file']):
             valid_imgs, valid_labels = parse_annotation_csv(config['valid']['valid_csv_file'],
                                                             config['model']['labels'],
-                                                            config['valid']['valid_csv_base_path'])
+                                                            config['valid']['valid_csv_base_path'],
+                                                            cache_dir=config.get('annotation_cache_dir', ''),
+                                                            as_table=True)
             split = False
         else:
             split = True
@@ -66,10 +74,10 @@ def _main_(args):
 
     if split:
         train_valid_split = int(0.8*len(train_imgs))
-        np.random.shuffle(train_imgs)
+        indices = np.random.permutation(len(train_imgs))
 
-        valid_imgs = train_imgs[train_valid_split:]
-        train_imgs = train_imgs[:train_valid_split]
+        valid_imgs = train_imgs.subset(indices[train_valid_split:])
+        train_imgs = train_imgs.subset(indices[:train_valid_split])
 
     if len(config['model']['labels']) > 0:
         overlap_labels = set(config['model']['labels']).intersection(set(train_labels.keys()))